@@ -0,0 +1,187 @@
+import hashlib
+import logging
+
+from PyPDF2 import PdfWriter
+from PyPDF2.generic import ArrayObject, ByteStringObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+from template_bundle import renumbered, serialize
+
+
+logger = logging.getLogger(__name__)
+
+
+def template_range(start, end, total):
+    """Intervallo [start, end) del template limitato alle pagine esistenti."""
+    end = total if end is None else min(end, total)
+    return range(min(start, end), end)
+
+
+def assemble(layout, template_pages, section_pages, writer=None):
+    """
+    Compone il documento finale in un unico PdfWriter seguendo il layout.
+    Ogni voce del layout è:
+    - ("template", inizio, fine): pagine del template [inizio, fine), fine=None fino all'ultima
+    - ("sezione", nome): pagine custom già renderizzate della sezione
+    Le pagine del template arrivano già parsate dal registro, quelle custom da
+    un unico reader: nessun buffer intermedio viene riletto.
+    """
+    if writer is None:
+        writer = PdfWriter()
+
+    for entry in layout:
+        if entry[0] == "template":
+            _, start, end = entry
+            for i in template_range(start, end, len(template_pages)):
+                writer.add_page(template_pages[i])
+        else:
+            for page in section_pages.get(entry[1], ()):
+                writer.add_page(page)
+
+    return writer
+
+
+class BundledDocument:
+    """
+    Documento finale con il template compilato (vedi template_bundle.py):
+    gli oggetti del template sono copiati come blocco di byte con i numeri
+    1..N, quelli delle pagine custom vengono dal writer, spostati di N.
+    Espone writer (solo pagine custom, es. per optimize.py), write() e pages.
+
+    L'output dipende solo dal contenuto: oggetti nell'ordine di pagine e
+    writer, nessuna data nei metadati e /ID calcolato dall'MD5 dei byte
+    scritti, così gli stessi dati producono un file identico byte per byte.
+    """
+
+    def __init__(self, bundle, writer, kids, labels=None):
+        self.bundle = bundle
+        self.writer = writer
+        # Pagine in ordine: ("template", numero oggetto) o ("sezione", pagina nel writer).
+        # Le pagine custom restano oggetti fino a write(): optimize.py può rinumerarle
+        self.kids = kids
+        self.labels = labels
+
+    @property
+    def pages(self):
+        return self.kids
+
+    def write(self, stream):
+        bundle = self.bundle
+        writer = self.writer
+        # Oggetti esterni ancora referenziati: li porta nel writer come fa write()
+        writer._sweep_indirect_references(writer._root)
+        # L'albero delle pagine del writer (oggetto 1) diventa il numero riservato N+1
+        if writer._pages.idnum != 1:
+            raise RuntimeError(f"Albero delle pagine del writer inatteso (oggetto {writer._pages.idnum}, atteso 1)")
+
+        def shift(idnum):
+            return idnum + bundle.count
+
+        digest = hashlib.md5()
+
+        def emit(data):
+            digest.update(data)
+            stream.write(data)
+
+        header = max(bundle.header, writer.pdf_header)
+        emit(header + b"\n%\xE2\xE3\xCF\xD3\n")
+
+        # Posizione di ogni oggetto (None = numero libero, oggetto non scritto)
+        template_pages = {number for origin, number in self.kids if origin == "template"}
+        if template_pages == set(bundle.pages):
+            base = stream.tell()
+            emit(bundle.blob)
+            positions = [base + offset for offset in bundle.offsets]
+        else:
+            # Selezione di pagine: solo gli oggetti del template che servono a quelle scelte
+            positions = [None] * bundle.count
+            for number in bundle.objects_for(template_pages):
+                positions[number - 1] = stream.tell()
+                emit(bundle.object_bytes(number))
+
+        kids = ArrayObject(
+            IndirectObject(page if origin == "template" else shift(page.indirect_reference.idnum), 0, None)
+            for origin, page in self.kids
+        )
+        pages = DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Count"): NumberObject(len(kids)),
+            NameObject("/Kids"): kids,
+        })
+
+        for index, obj in enumerate(writer._objects):
+            if obj is None:
+                positions.append(None)
+                continue
+            idnum = index + 1
+            if idnum == 1:
+                obj = pages
+            else:
+                obj = renumbered(obj, shift)
+                if idnum == writer._root.idnum and self.labels:
+                    obj[NameObject("/PageLabels")] = page_labels(self.labels)
+            positions.append(stream.tell())
+            emit(serialize(shift(idnum), obj))
+
+        xref = stream.tell()
+        size = len(positions) + 1
+        emit(b"xref\n0 %d\n" % size)
+        emit(xref_entries(positions))
+        document_id = ByteStringObject(digest.digest())
+        trailer = DictionaryObject({
+            NameObject("/Size"): NumberObject(size),
+            NameObject("/Root"): IndirectObject(shift(writer._root.idnum), 0, None),
+            NameObject("/Info"): IndirectObject(shift(writer._info.idnum), 0, None),
+            NameObject("/ID"): ArrayObject([document_id, document_id]),
+        })
+        stream.write(b"trailer\n")
+        trailer.write_to_stream(stream, None)
+        stream.write(b"\nstartxref\n%d\n%%%%EOF\n" % xref)
+
+
+def xref_entries(positions):
+    """
+    Righe della tabella xref per gli oggetti 1..n: posizione, oppure voce
+    libera (None) collegata alla successiva come richiede il formato PDF.
+    """
+    free = [number for number, position in enumerate(positions, 1) if position is None]
+    next_free = dict(zip([0] + free, free + [0]))
+    lines = [b"%010d 65535 f \n" % next_free[0]]
+    for number, position in enumerate(positions, 1):
+        if position is None:
+            lines.append(b"%010d 00000 f \n" % next_free[number])
+        else:
+            lines.append(b"%010d 00000 n \n" % position)
+    return b"".join(lines)
+
+
+def page_labels(numbers):
+    """
+    Albero /PageLabels: la pagina i del documento viene mostrata dai lettori
+    PDF come numbers[i] (es. il numero che ha nel report completo).
+    """
+    nums = ArrayObject()
+    for index, number in enumerate(numbers):
+        if index == 0 or number != numbers[index - 1] + 1:
+            nums.append(NumberObject(index))
+            nums.append(DictionaryObject({NameObject("/S"): NameObject("/D"), NameObject("/St"): NumberObject(number)}))
+    return DictionaryObject({NameObject("/Nums"): nums})
+
+
+def assemble_bundle(layout, bundle, section_pages, labels=None):
+    """
+    Come assemble, ma con il template compilato: le pagine del template non
+    passano da PyPDF2, quelle custom vengono aggiunte a un PdfWriter.
+    labels (opzionale) sono i numeri da mostrare per ogni pagina.
+    """
+    writer = PdfWriter()
+    kids = []
+    for entry in layout:
+        if entry[0] == "template":
+            _, start, end = entry
+            for i in template_range(start, end, len(bundle)):
+                kids.append(("template", bundle.pages[i]))
+        else:
+            for page in section_pages.get(entry[1], ()):
+                kids.append(("sezione", writer.add_page(page)))
+
+    return BundledDocument(bundle, writer, kids, labels)
@@ -0,0 +1,135 @@
+import json
+import asyncio
+import logging
+import zipfile
+
+
+logger = logging.getLogger(__name__)
+
+
+class _ZipSink:
+    """Destinazione non seekable per ZipFile: accumula i byte da inviare al client."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+async def iter_ndjson(stream):
+    """
+    Legge un flusso NDJSON riga per riga mentre arriva.
+    Restituisce (indice, oggetto) oppure (indice, eccezione) per le righe non
+    valide, che verranno segnalate nel manifest come errori del singolo elemento.
+    """
+    buffer = b""
+    index = 0
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield index, json.loads(line)
+            except ValueError as e:
+                yield index, e
+            index += 1
+
+    if buffer.strip():
+        try:
+            yield index, json.loads(buffer)
+        except ValueError as e:
+            yield index, e
+
+
+async def iter_list(items):
+    for index, item in enumerate(items):
+        yield index, item
+
+
+async def stream_zip(items, render, concurrency):
+    """
+    Genera un archivio ZIP man mano che i documenti vengono completati.
+    - items: async iterator di (indice, payload) (o eccezione per i payload non validi)
+    - render: coroutine function payload -> (nome_file, bytes)
+    - concurrency: documenti renderizzati contemporaneamente
+    Gli errori dei singoli elementi finiscono in manifest.json (ultimo file
+    dell'archivio) senza interrompere il batch.
+    """
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED)
+    results = asyncio.Queue()
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+    manifest = []
+
+    async def render_item(index, payload):
+        async with semaphore:
+            try:
+                if isinstance(payload, Exception):
+                    raise payload
+                filename, pdf_bytes = await render(payload)
+                await results.put((index, filename, pdf_bytes, None))
+            except Exception as e:
+                await results.put((index, None, None, str(e)))
+
+    async def produce():
+        count = 0
+        async for index, payload in items:
+            task = asyncio.create_task(render_item(index, payload))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            count += 1
+        return count
+
+    producer = asyncio.create_task(produce())
+    received = 0
+    try:
+        while True:
+            if producer.done() and (producer.exception() is not None or received == producer.result()):
+                break
+
+            getter = asyncio.create_task(results.get())
+            done, _ = await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                continue
+
+            index, filename, pdf_bytes, error = getter.result()
+            received += 1
+            if error is None:
+                name = f"{index + 1:04d}_{filename}"
+                with archive.open(name, mode="w", force_zip64=True) as entry:
+                    entry.write(pdf_bytes)
+                manifest.append({"indice": index, "stato": "ok", "file": name, "byte": len(pdf_bytes)})
+            else:
+                logger.warning(f"Batch: elemento {index} non generato: {error}")
+                manifest.append({"indice": index, "stato": "errore", "errore": error})
+            yield sink.drain()
+
+        if producer.exception() is not None:
+            error = producer.exception()
+            logger.warning(f"Batch: lettura della richiesta interrotta: {str(error)}")
+            manifest.append({"indice": None, "stato": "errore", "errore": f"Richiesta non valida: {str(error)}"})
+
+        manifest.sort(key=lambda item: (item["indice"] is None, item["indice"] or 0))
+        archive.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+        archive.close()
+        yield sink.drain()
+
+    finally:
+        # Client disconnesso o errore: non lasciare render orfani
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
@@ -0,0 +1,7 @@
+"""
+Benchmark del servizio PDF.
+
+Ogni modulo si lancia dalla root del progetto, ad esempio:
+
+    python -m benchmarks.bench_gradient
+"""
@@ -0,0 +1,57 @@
+"""
+Confronta lo sfondo gradiente disegnato pagina per pagina (200 rect a pagina)
+con lo sfondo definito una volta come Form XObject e richiamato con doForm.
+
+    python -m benchmarks.bench_gradient [--pages 1 5 20 50] [--repeat 5]
+"""
+import io
+import argparse
+
+from reportlab.pdfgen import canvas
+
+import report
+from benchmarks.timing import best_of
+
+
+def render_inline(pages):
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=report.PAGE_SIZE)
+    for _ in range(pages):
+        report.draw_vertical_gradient(
+            c, report.PAGE_SIZE[0], report.PAGE_SIZE[1],
+            report.TOP_COLOR, report.MID_COLOR, report.BOTTOM_COLOR,
+        )
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def render_form(pages):
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=report.PAGE_SIZE)
+    for _ in range(pages):
+        report.draw_background(c)
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 5, 20, 50])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'pagine':>6}  {'inline ms':>10}  {'form ms':>10}  {'inline KB':>10}  {'form KB':>10}")
+    for pages in args.pages:
+        t_inline = best_of(lambda: render_inline(pages), args.repeat)
+        t_form = best_of(lambda: render_form(pages), args.repeat)
+        s_inline, s_form = len(render_inline(pages)), len(render_form(pages))
+        print(
+            f"{pages:>6}  {t_inline * 1000:>10.1f}  {t_form * 1000:>10.1f}  "
+            f"{s_inline / 1024:>10.1f}  {s_form / 1024:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Misura separatamente le due fasi del layout delle sezioni: measure pass
+(a capo e interruzioni di pagina) e paint pass (disegno sul canvas).
+
+    python -m benchmarks.bench_layout [--items 5 20 100] [--repeat 5]
+"""
+import io
+import argparse
+
+from reportlab.pdfgen import canvas
+
+import report
+from layout import paint
+from benchmarks.timing import best_of
+
+
+WORDS = "qualità prodotto cliente spedizione materiali risultato esperienza fiducia".split()
+
+
+def sample_data(items):
+    """Payload sintetico con items voci (e relative spiegazioni) per sezione a elenco."""
+    def text(i, words):
+        return " ".join(WORDS[(i + k) % len(WORDS)] for k in range(words))
+
+    voci = "|".join(text(i, 3) for i in range(items))
+    spiegazioni = "|".join(text(i, 40) for i in range(items))
+    return {
+        "sito_web": "www.esempio.it",
+        "benefici_prodotti": voci,
+        "spiegazione_benefici_prodotti": spiegazioni,
+        "bisogni_robbins": voci,
+        "spiegazione_bisogni_robbins": spiegazioni,
+        "bisogni_derivati": voci,
+        "spiegazione_bisogni_derivati": spiegazioni,
+        "domande_tecniche": voci,
+        "target_demografico": {field: text(0, 30) for field in ("eta", "genere", "professione", "interessi", "stile_vita")},
+        "obiezioni": {field: text(1, 30) for field in ("necessita", "possibilita", "tipo_soluzione", "risultati", "credibilita_azienda")},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, nargs="+", default=[5, 20, 100])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'voci':>6}  {'pagine':>6}  {'measure ms':>10}  {'paint ms':>10}")
+    for items in args.items:
+        data = sample_data(items)
+
+        def measure_all():
+            return {name: report.measure_section(name, data) for name in report.SECTIONS}
+
+        def paint_all():
+            c = canvas.Canvas(io.BytesIO(), pagesize=report.PAGE_SIZE)
+            for name, pages in measured.items():
+                spec = report.SECTIONS[name]
+                paint(c, pages, lambda c: report.draw_page_chrome(c, spec.title), spec.line_height)
+
+        measured = measure_all()
+        t_measure = best_of(measure_all, args.repeat)
+        t_paint = best_of(paint_all, args.repeat)
+        pages = sum(len(p) for p in measured.values())
+        print(f"{items:>6}  {pages:>6}  {t_measure * 1000:>10.2f}  {t_paint * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
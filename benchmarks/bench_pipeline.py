@@ -0,0 +1,148 @@
+"""
+Microbenchmark delle fasi della pipeline PDF, per profilo di payload
+(vedi benchmarks/payloads.py): sfondo gradiente, a capo del testo, render di
+ogni sezione e unione finale con il template.
+
+    python -m benchmarks.bench_pipeline [--profiles small typical] [--repeat 5] [--json risultati.json]
+
+I tempi sono il migliore di --repeat esecuzioni, in millisecondi.
+"""
+import io
+import sys
+import json
+import argparse
+import platform
+
+import reportlab
+import PyPDF2
+from PyPDF2 import PdfReader
+from reportlab.pdfgen import canvas
+
+import report
+from assembler import assemble
+from linebreak import LineBreaker
+from benchmarks import payloads
+from benchmarks.timing import best_of
+
+
+def bench_gradient(repeat):
+    def run():
+        c = canvas.Canvas(io.BytesIO(), pagesize=report.PAGE_SIZE)
+        report.draw_vertical_gradient(
+            c, report.PAGE_SIZE[0], report.PAGE_SIZE[1],
+            report.TOP_COLOR, report.MID_COLOR, report.BOTTOM_COLOR,
+        )
+
+    return best_of(run, repeat) * 1000
+
+
+def paragraphs(data):
+    """Tutti i paragrafi che il layout manda a capo, con il loro stile."""
+    result = []
+    for spec in report.SECTIONS.values():
+        for item in spec.source.items(data):
+            for paragraph in item.paragraphs:
+                result.append((paragraph, spec.body.font, spec.body.size))
+    return result
+
+
+def bench_wrap(data, repeat):
+    texts = paragraphs(data)
+    width = report.PAGE_SIZE[0] - 200
+    breaker = LineBreaker()
+
+    def run():
+        for text, font, size in texts:
+            breaker.wrap(text, font, size, width)
+
+    cold = best_of(run, repeat, setup=breaker.clear) * 1000
+    warm = best_of(run, repeat) * 1000
+    return {"paragrafi": len(texts), "cache_vuota": cold, "cache_calda": warm}
+
+
+def bench_sections(data, repeat):
+    results = {}
+    for name in report.SECTIONS:
+        section = report.section_data(name, data)
+        pdf_bytes, _ = report.render_section(name, section)
+        results[name] = {
+            "ms": best_of(lambda: report.render_section(name, section), repeat) * 1000,
+            "pagine": len(PdfReader(io.BytesIO(pdf_bytes)).pages),
+        }
+    return results
+
+
+def bench_merge(data, repeat):
+    buffer, ranges, _ = report.render_sections(data)
+    reader = PdfReader(buffer)
+    section_pages = {name: [reader.pages[i] for i in range(start, end)] for name, (start, end) in ranges.items()}
+
+    sizes = []
+
+    def run():
+        output = report.write_report(section_pages, {})
+        sizes.append(output.size)
+        output.cleanup()
+
+    def run_pypdf2():
+        # Riferimento: template copiato pagina per pagina con PyPDF2 (add_page)
+        writer = assemble(report.REPORT_LAYOUT, report.load_template().pages, section_pages)
+        writer.write(io.BytesIO())
+
+    ms = best_of(run, repeat) * 1000
+    return {"ms": ms, "ms_pypdf2": best_of(run_pypdf2, repeat) * 1000, "byte": sizes[-1]}
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "reportlab": reportlab.Version,
+        "PyPDF2": PyPDF2.__version__,
+        "render_version": report.render_version(),
+        "piattaforma": platform.platform(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=["small", "typical", "pathological"], choices=sorted(payloads.PROFILES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", metavar="FILE", help="scrive i risultati in JSON (- per stdout)")
+    args = parser.parse_args()
+
+    results = {"ambiente": environment(), "gradiente_ms": bench_gradient(args.repeat), "profili": {}}
+    print(f"gradiente (1 pagina): {results['gradiente_ms']:.2f} ms", file=sys.stderr)
+
+    for profile in args.profiles:
+        data = payloads.payload(profile)
+        # Il profilo patologico è lento: basta meno ripetizioni
+        repeat = args.repeat if profile != "pathological" else max(1, args.repeat // 5)
+        wrap = bench_wrap(data, repeat)
+        sections = bench_sections(data, repeat)
+        merge = bench_merge(data, repeat)
+        results["profili"][profile] = {"a_capo": wrap, "sezioni": sections, "unione": merge}
+
+        print(f"\n[{profile}]", file=sys.stderr)
+        print(
+            f"  a capo: {wrap['paragrafi']} paragrafi, cache vuota {wrap['cache_vuota']:.2f} ms, "
+            f"cache calda {wrap['cache_calda']:.2f} ms",
+            file=sys.stderr,
+        )
+        for name, result in sections.items():
+            print(f"  sezione {name:<12} {result['ms']:9.2f} ms  {result['pagine']:4d} pagine", file=sys.stderr)
+        print(
+            f"  unione + scrittura   {merge['ms']:9.2f} ms  {merge['byte'] / 1024:.0f} KB "
+            f"(con add_page PyPDF2: {merge['ms_pypdf2']:.2f} ms)",
+            file=sys.stderr,
+        )
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Confronta due modi di scrivere il testo delle sezioni custom:
+- drawstring: un drawString (BT ... ET, posizione assoluta) per ogni riga e
+  un setFont del canvas a ogni cambio di stile e a ogni pagina
+- textobject: un oggetto di testo per pagina (layout.paint), font impostato
+  solo quando cambia, righe successive con T*
+
+Per ogni profilo di payload (vedi benchmarks/payloads.py): righe disegnate,
+byte degli stream di contenuto (non compressi), tempo di disegno + save()
+di ReportLab e dimensione del PDF.
+
+    python -m benchmarks.bench_text [--profiles typical pathological] [--repeat 5]
+"""
+import io
+import argparse
+
+from reportlab.pdfgen import canvas
+
+import report
+from layout import paint
+from benchmarks import payloads
+from benchmarks.timing import best_of
+
+
+def chrome_drawstring(c, title):
+    report.draw_background(c)
+    c.setFillColor(report.WHITE)
+    c.setFont("Montserrat-ExtraBold", 80)
+    c.drawString(100, 675, "ANALISI DI MERCATO")
+    if title:
+        c.setFont("Montserrat-Regular", 26)
+        c.drawString(100, 626, title.upper())
+
+
+def paint_drawstring(c, pages, begin_page, line_height):
+    for lines in pages:
+        begin_page(c)
+        style = None
+        for line in lines:
+            if line.style != style:
+                style = line.style
+                c.setFont(style.font, style.size)
+            c.drawString(line.x, line.y, line.text)
+        c.showPage()
+
+
+def render(measured, paint_fn, chrome, compress):
+    """PDF delle sezioni già misurate; restituisce (pdf, byte degli stream di contenuto)."""
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=report.PAGE_SIZE, pageCompression=compress)
+    content = 0
+    for name, pages in measured.items():
+        spec = report.SECTIONS[name]
+        for page in pages:
+            paint_fn(c, [page], lambda c: chrome(c, spec.title), spec.line_height)
+            content += len(c._doc.Pages.pages[-1].stream)
+    c.save()
+    return buffer.getvalue(), content
+
+
+MODES = {
+    "drawstring": (paint_drawstring, chrome_drawstring),
+    "textobject": (paint, report.draw_page_chrome),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=list(payloads.PROFILES), choices=list(payloads.PROFILES))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'profilo':<13}  {'modo':<10}  {'righe':>6}  {'contenuti KB':>12}  {'ms':>8}  {'PDF KB':>8}")
+    for profile in args.profiles:
+        data = payloads.make_payload(**payloads.PROFILES[profile])
+        measured = {name: report.measure_section(name, data) for name in report.SECTIONS}
+        lines = sum(len(page) for pages in measured.values() for page in pages)
+
+        for mode, (paint_fn, chrome) in MODES.items():
+            _, content = render(measured, paint_fn, chrome, compress=0)
+            pdf, _ = render(measured, paint_fn, chrome, compress=1)
+            elapsed = best_of(lambda: render(measured, paint_fn, chrome, compress=1), args.repeat)
+            print(
+                f"{profile:<13}  {mode:<10}  {lines:>6}  {content / 1024:>12.1f}  "
+                f"{elapsed * 1000:>8.1f}  {len(pdf) / 1024:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
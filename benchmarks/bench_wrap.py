@@ -0,0 +1,79 @@
+"""
+Confronta gli a capo di reportlab simpleSplit con LineBreaker (linebreak.py)
+su paragrafi italiani realistici: cache vuota (solo larghezze delle parole)
+e cache calda (stessi report generati di nuovo).
+
+    python -m benchmarks.bench_wrap [--reports 50] [--repeat 5]
+"""
+import argparse
+
+from reportlab.lib.utils import simpleSplit
+
+import report
+from linebreak import LineBreaker
+from benchmarks.timing import best_of
+
+
+FONT = "Montserrat-Regular"
+SIZE = 29.2
+WIDTH = report.PAGE_SIZE[0] - 200
+
+FRASI = [
+    "Il prodotto è realizzato a mano con materiali di alta qualità e garantisce una durata superiore alla media.",
+    "La spedizione è gratuita per ordini superiori a cinquanta euro e avviene entro due giorni lavorativi.",
+    "I clienti cercano sicurezza, riconoscimento sociale e la sensazione di aver fatto un acquisto consapevole.",
+    "Il servizio clienti risponde in meno di un'ora e offre assistenza personalizzata anche dopo l'acquisto.",
+    "La possibilità di personalizzare il prodotto aumenta il legame emotivo con il marchio e la fedeltà nel tempo.",
+    "Molti potenziali clienti ritengono il prezzo elevato finché non confrontano qualità e durata con la concorrenza.",
+]
+
+
+def sample_paragraphs(reports):
+    """
+    Paragrafi di reports report diversi: le frasi si ricombinano come nei
+    payload reali, più i testi fissi della sezione competitor.
+    """
+    paragraphs = []
+    for i in range(reports):
+        sito = f"www.negozio{i}.it"
+        for k in range(len(FRASI)):
+            paragraphs.append(" ".join(FRASI[(k + j + i) % len(FRASI)] for j in range(1 + (i + k) % 3)))
+        for _, text in report.SECTIONS["competitor"].source.blocks:
+            paragraphs.append(text.format(sito_web=sito))
+    return paragraphs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    paragraphs = sample_paragraphs(args.reports)
+    breaker = LineBreaker()
+
+    for text in paragraphs:
+        assert list(breaker.wrap(text, FONT, SIZE, WIDTH)) == simpleSplit(text, FONT, SIZE, WIDTH)
+
+    def run_simple():
+        for text in paragraphs:
+            simpleSplit(text, FONT, SIZE, WIDTH)
+
+    def run_breaker():
+        for text in paragraphs:
+            breaker.wrap(text, FONT, SIZE, WIDTH)
+
+    t_simple = best_of(run_simple, args.repeat)
+    t_cold = best_of(run_breaker, args.repeat, setup=breaker.clear)
+    breaker.clear()
+    run_breaker()
+    t_warm = best_of(run_breaker, args.repeat)
+
+    print(f"{len(paragraphs)} paragrafi ({args.reports} report)")
+    print(f"{'simpleSplit':>18}  {t_simple * 1000:8.2f} ms")
+    print(f"{'cache vuota':>18}  {t_cold * 1000:8.2f} ms  ({t_simple / t_cold:.1f}x)")
+    print(f"{'cache calda':>18}  {t_warm * 1000:8.2f} ms  ({t_simple / t_warm:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Test di carico in-process dell'app FastAPI: avvia l'app (lifespan compreso,
+quindi pool di worker e warm-up) e invia richieste a /generate-pdf con N
+client concorrenti, senza passare dalla rete.
+Stampa un JSON con latenze p50/p95/p99, throughput, errori e RSS di picco,
+da salvare e confrontare nel tempo. Richiede httpx (pip install httpx).
+
+    python -m benchmarks.loadtest [--profile typical] [--requests 200] [--concurrency 8] [--output risultati.json]
+
+La cache dei risultati è disattivata (PDF_CACHE_MAX_BYTES=0) salvo --cache,
+e ogni richiesta usa un payload diverso: si misura il rendering, non la cache.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import multiprocessing
+
+from benchmarks import payloads
+from benchmarks.bench_pipeline import environment
+
+
+def percentile(values, p):
+    """Percentile con interpolazione lineare (values ordinati)."""
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+def peak_rss_mb():
+    # ru_maxrss è in KB su Linux, in byte su macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def workers_peak_rss_mb():
+    """
+    Picco RSS (VmHWM) di ogni worker del pool ancora attivo, solo su Linux.
+    RUSAGE_CHILDREN non basta: dopo il fork il figlio eredita il picco del padre.
+    """
+    peaks = []
+    for child in multiprocessing.active_children():
+        try:
+            with open(f"/proc/{child.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        peaks.append(int(line.split()[1]) / 1024)
+        except OSError:
+            continue
+    return peaks
+
+
+async def run(args):
+    import httpx
+    import main
+
+    requests = [{"data": payloads.payload(args.profile, seed=i)} for i in range(args.requests)]
+    latencies = []
+    statuses = {}
+    total_bytes = 0
+    queue = asyncio.Queue()
+    for body in requests:
+        queue.put_nowait(body)
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+
+            async def worker():
+                nonlocal total_bytes
+                while True:
+                    try:
+                        body = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    t0 = time.perf_counter()
+                    response = await client.post("/generate-pdf", json=body)
+                    elapsed = time.perf_counter() - t0
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                    if response.status_code == 200:
+                        latencies.append(elapsed)
+                        total_bytes += len(response.content)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            duration = time.perf_counter() - start
+            worker_peaks = workers_peak_rss_mb()
+
+    latencies.sort()
+    return {
+        "ambiente": environment(),
+        "parametri": {
+            "profilo": args.profile,
+            "richieste": args.requests,
+            "concorrenza": args.concurrency,
+            "worker": main.engine.workers,
+            "cache": args.cache,
+        },
+        "durata_s": duration,
+        "throughput_rps": len(latencies) / duration if duration else None,
+        "latenza_ms": {
+            "p50": percentile(latencies, 50) * 1000 if latencies else None,
+            "p95": percentile(latencies, 95) * 1000 if latencies else None,
+            "p99": percentile(latencies, 99) * 1000 if latencies else None,
+            "max": latencies[-1] * 1000 if latencies else None,
+        },
+        "stati_http": {str(status): count for status, count in sorted(statuses.items())},
+        "byte_medi": total_bytes / len(latencies) if latencies else None,
+        "rss_picco_mb": {
+            "processo": peak_rss_mb(),
+            "worker_max": max(worker_peaks) if worker_peaks else None,
+            "worker_totale": sum(worker_peaks) if worker_peaks else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", default="typical", choices=sorted(payloads.PROFILES))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--cache", action="store_true", help="lascia attiva la cache dei risultati")
+    parser.add_argument("--output", metavar="FILE", help="scrive il JSON su file invece che su stdout")
+    args = parser.parse_args()
+
+    if not args.cache:
+        os.environ["PDF_CACHE_MAX_BYTES"] = "0"
+
+    results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
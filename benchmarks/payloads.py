@@ -0,0 +1,65 @@
+"""
+Payload sintetici per benchmark e test di carico, deterministici (seed fisso):
+- small: poche voci brevi
+- typical: dimensioni di un report reale
+- pathological: centinaia di benefici separati da | e obiezioni lunghissime
+"""
+import random
+
+
+PAROLE = (
+    "qualità prodotto cliente spedizione materiali risultato esperienza fiducia marchio prezzo "
+    "garanzia assistenza servizio valore tempo acquisto scelta sicurezza design comodità "
+    "sostenibile artigianale affidabile rapido personalizzato esclusivo moderno semplice "
+    "concorrenza mercato bisogno soluzione recensioni online negozio offerta durata"
+).split()
+
+DEMOGRAFICI = ("eta", "genere", "professione", "interessi", "stile_vita")
+OBIEZIONI = ("necessita", "possibilita", "tipo_soluzione", "risultati", "credibilita_azienda")
+
+
+def sentence(rng, words):
+    text = " ".join(rng.choice(PAROLE) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def make_payload(items, words, obiezioni_parts, obiezioni_words, seed=0):
+    """
+    Payload completo: items voci per ogni sezione a elenco, spiegazioni di
+    words parole, obiezioni con obiezioni_parts paragrafi (separati da |)
+    di obiezioni_words parole.
+    """
+    rng = random.Random(seed)
+
+    def voci(n):
+        return "|".join(" ".join(rng.choice(PAROLE) for _ in range(rng.randint(1, 3))).capitalize() for _ in range(n))
+
+    def spiegazioni(n):
+        return "|".join(sentence(rng, words) for _ in range(n))
+
+    return {
+        "sito_web": f"www.negozio{seed}.it",
+        "benefici_prodotti": voci(items),
+        "spiegazione_benefici_prodotti": spiegazioni(items),
+        "bisogni_robbins": voci(items),
+        "spiegazione_bisogni_robbins": spiegazioni(items),
+        "target_demografico": {field: sentence(rng, words // 2 or 1) for field in DEMOGRAFICI},
+        "obiezioni": {
+            field: "|".join(sentence(rng, obiezioni_words) for _ in range(obiezioni_parts)) for field in OBIEZIONI
+        },
+        "domande_tecniche": "|".join(sentence(rng, 8)[:-1] + "?" for _ in range(items)),
+        "bisogni_derivati": voci(items),
+        "spiegazione_bisogni_derivati": spiegazioni(items),
+    }
+
+
+PROFILES = {
+    "small": dict(items=2, words=10, obiezioni_parts=1, obiezioni_words=8),
+    "typical": dict(items=5, words=35, obiezioni_parts=2, obiezioni_words=20),
+    "pathological": dict(items=300, words=60, obiezioni_parts=20, obiezioni_words=400),
+}
+
+
+def payload(profile, seed=0):
+    """Payload del profilo indicato (small, typical, pathological)."""
+    return make_payload(seed=seed, **PROFILES[profile])
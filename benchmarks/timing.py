@@ -0,0 +1,18 @@
+"""Misura dei tempi condivisa dai benchmark."""
+import time
+
+
+def best_of(fn, repeat, setup=None):
+    """
+    Tempo migliore, in secondi, di repeat esecuzioni di fn(); setup(), se
+    presente, viene chiamata prima di ogni esecuzione fuori dalla misura.
+    """
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
@@ -0,0 +1,217 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+def canonical_hash(data, *versions):
+    """
+    Hash canonico dei dati di una richiesta: le chiavi vengono ordinate, così
+    lo stesso payload produce sempre la stessa chiave indipendentemente
+    dall'ordine dei campi. versions (template, font, ...) entrano nella chiave.
+    """
+    payload = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    h = hashlib.sha256()
+    for version in versions:
+        h.update(str(version).encode("utf-8"))
+        h.update(b"\0")
+    h.update(payload.encode("utf-8"))
+    return h.hexdigest()
+
+
+class LRUCache:
+    """
+    Cache LRU in memoria limitata per dimensione totale in byte.
+    I valori più grandi di max_entry_bytes non vengono memorizzati.
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_entry_bytes:
+            return False
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += len(value)
+
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+        return True
+
+
+class FragmentCache(LRUCache):
+    """
+    Cache LRU dei PDF delle singole sezioni (nel processo principale): la
+    chiave include solo i campi letti dalla sezione, così modificando un campo
+    viene renderizzata di nuovo solo la sezione interessata.
+    """
+
+    def __init__(self, max_bytes):
+        super().__init__(max_bytes)
+        self.enabled = max_bytes > 0
+
+
+class DiskCache:
+    """
+    Livello su disco (opzionale): un file per chiave, scritto in modo atomico.
+    Quando la directory supera max_bytes vengono rimossi i file usati meno di
+    recente.
+    """
+
+    def __init__(self, directory, max_bytes, suffix=".pdf"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # Aggiorna l'mtime: serve all'eviction LRU
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Impossibile scrivere in cache su disco: {str(e)}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return False
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(value)
+            if self._size > self.max_bytes:
+                self._prune()
+        return True
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _prune(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        # Scende sotto il 90% del limite per non ripulire a ogni scrittura
+        target = self.max_bytes * 0.9
+        for _, size, name in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._size = total
+
+
+class ResultCache:
+    """
+    Cache dei PDF generati, indirizzata per contenuto: la chiave è l'hash
+    canonico dei dati più le versioni di template, font e grafica.
+    Livello LRU in memoria più livello su disco opzionale (PDF_CACHE_DIR).
+    """
+
+    def __init__(self, max_bytes=None, max_entry_bytes=None, directory=None, disk_max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("PDF_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+        if max_entry_bytes is None:
+            max_entry_bytes = int(os.environ.get("PDF_CACHE_MAX_ENTRY_BYTES", 16 * 1024 * 1024))
+        if directory is None:
+            directory = os.environ.get("PDF_CACHE_DIR") or None
+        if disk_max_bytes is None:
+            disk_max_bytes = int(os.environ.get("PDF_CACHE_DISK_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+
+        self.enabled = max_bytes > 0
+        self.memory = LRUCache(max_bytes, max_entry_bytes)
+        self.disk = DiskCache(directory, disk_max_bytes) if directory else None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, data, *versions):
+        return canonical_hash(data, *versions)
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if not self.enabled or len(value) > self.memory.max_entry_bytes:
+            return
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
@@ -0,0 +1,397 @@
+import os
+import asyncio
+import logging
+import uuid
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import report
+import metrics
+from cache import FragmentCache, canonical_hash
+
+
+logger = logging.getLogger(__name__)
+
+
+class EngineBusy(Exception):
+    """Coda piena: la richiesta va rifiutata (503 + Retry-After)."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Motore di rendering occupato, riprovare tra {retry_after} secondi")
+        self.retry_after = retry_after
+
+
+class EngineTimeout(Exception):
+    """Il job ha superato il tempo massimo consentito."""
+
+
+class ReportTooLarge(Exception):
+    """Il report richiede più memoria dell'intero budget del motore: va rifiutato (413)."""
+
+
+class MemoryBudget:
+    """
+    Budget di memoria condiviso dai job del motore (limit in byte, 0 = nessun
+    limite). Un job riserva la memoria stimata prima di partire e la libera
+    quando i suoi worker hanno finito; se non c'è abbastanza memoria libera
+    attende il proprio turno, in ordine di arrivo (un job grande non viene
+    scavalcato all'infinito da quelli piccoli).
+    release può essere chiamata da qualsiasi thread.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.reserved = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.limit > 0
+
+    def check(self, amount):
+        if self.enabled and amount > self.limit:
+            raise ReportTooLarge(
+                f"Report troppo grande: servono circa {amount // 2**20} MB, "
+                f"il limite del motore è {self.limit // 2**20} MB"
+            )
+
+    async def acquire(self, amount, timeout):
+        """
+        Riserva amount byte, attendendo al massimo timeout secondi.
+        Restituisce False se il tempo scade senza che la memoria si liberi.
+        """
+        if not self.enabled or amount <= 0:
+            return True
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters and self.reserved + amount <= self.limit:
+                self.reserved += amount
+                return True
+            waiter = {"byte": amount, "future": loop.create_future(), "loop": loop, "concesso": False}
+            self._waiters.append(waiter)
+            logger.info(f"Memoria insufficiente ({self.reserved // 2**20} MB riservati su {self.limit // 2**20}): job in attesa")
+
+        try:
+            await asyncio.wait({waiter["future"]}, timeout=timeout)
+        except BaseException:
+            # Richiesta annullata: la memoria eventualmente già concessa torna libera
+            if self._withdraw(waiter):
+                self.release(amount)
+            raise
+        return self._withdraw(waiter)
+
+    def _withdraw(self, waiter):
+        """Toglie waiter dalla coda se ancora in attesa; True se la memoria gli era già stata concessa."""
+        with self._lock:
+            if waiter["concesso"]:
+                return True
+            self._waiters.remove(waiter)
+            # Chi era in coda dietro a questo job potrebbe ora partire
+            self._grant()
+            return False
+
+    def release(self, amount):
+        if not self.enabled or amount <= 0:
+            return
+        with self._lock:
+            self.reserved -= amount
+            self._grant()
+
+    def _grant(self):
+        """Sveglia, in ordine di arrivo, i job in attesa che ora ci stanno (con il lock preso)."""
+        while self._waiters and self.reserved + self._waiters[0]["byte"] <= self.limit:
+            waiter = self._waiters.popleft()
+            waiter["concesso"] = True
+            self.reserved += waiter["byte"]
+            waiter["loop"].call_soon_threadsafe(_set_done, waiter["future"])
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _discard_result(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    if hasattr(result, "cleanup"):
+        result.cleanup()
+
+
+class RenderEngine:
+    """
+    Motore di rendering: esegue la generazione dei PDF in un pool di processi
+    limitato, così il rendering (tutto CPU-bound) non blocca l'event loop di
+    uvicorn e gli altri endpoint restano reattivi.
+
+    - workers: numero di processi del pool
+    - max_queue: job accettati in attesa oltre a quelli in esecuzione
+    - job_timeout: secondi massimi di attesa per un singolo job
+    - retry_after: secondi suggeriti al client quando la coda è piena
+    - parallel_sections: renderizza le sezioni di un report in worker diversi
+    - fragment_cache_bytes: dimensione della cache dei PDF delle singole sezioni (0 = disattivata)
+    - memory_budget: byte di memoria stimata (vedi report.estimate_cost) che
+      i job in esecuzione possono occupare insieme (0 = nessun limite)
+    - spool_bytes: oltre questa stima il report viene scritto su disco
+    """
+
+    def __init__(self, workers=None, max_queue=None, job_timeout=None, retry_after=None, parallel_sections=None,
+                 fragment_cache_bytes=None, memory_budget=None, spool_bytes=None):
+        self.workers = workers or int(os.environ.get("PDF_WORKERS", os.cpu_count() or 1))
+        self.max_queue = max_queue if max_queue is not None else int(os.environ.get("PDF_MAX_QUEUE", self.workers * 2))
+        self.job_timeout = job_timeout or float(os.environ.get("PDF_JOB_TIMEOUT", 120))
+        self.retry_after = retry_after or int(os.environ.get("PDF_RETRY_AFTER", 5))
+        if parallel_sections is None:
+            parallel_sections = os.environ.get("PDF_PARALLEL_SECTIONS", "0").lower() in ("1", "true", "yes")
+        self.parallel_sections = parallel_sections
+        if fragment_cache_bytes is None:
+            fragment_cache_bytes = int(os.environ.get("PDF_FRAGMENT_CACHE_MAX_BYTES", 0))
+        self.fragments = FragmentCache(fragment_cache_bytes)
+        if memory_budget is None:
+            memory_budget = int(os.environ.get("PDF_MEMORY_BUDGET_MB", 1024)) * 1024 * 1024
+        self.memory = MemoryBudget(memory_budget)
+        if spool_bytes is None:
+            spool_bytes = int(os.environ.get("PDF_SPOOL_ESTIMATE_MB", 16)) * 1024 * 1024
+        self.spool_bytes = spool_bytes
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._progress_queue = None
+        self._progress_thread = None
+        self._progress_callbacks = {}
+
+    @property
+    def pending(self):
+        """Job in esecuzione o in coda."""
+        return self._pending
+
+    def start(self):
+        # "spawn" evita di duplicare col fork lo stato (thread, event loop) del processo uvicorn
+        context = multiprocessing.get_context("spawn")
+
+        # I worker segnalano l'avanzamento dei job su questa coda (passata
+        # all'avvio del processo, perché non può viaggiare insieme ai task)
+        self._progress_queue = context.Queue()
+        self._progress_thread = threading.Thread(target=self._listen_progress, name="pdf-progress", daemon=True)
+        self._progress_thread.start()
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=report.init_worker,
+            initargs=(self._progress_queue,),
+        )
+        logger.info(
+            f"Motore di rendering avviato: {self.workers} worker, coda max {self.max_queue}, "
+            f"timeout {self.job_timeout}s, sezioni in parallelo: {self.parallel_sections}, "
+            f"memoria: {f'{self.memory.limit // 2**20} MB' if self.memory.enabled else 'illimitata'}"
+        )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._progress_thread is not None:
+            self._progress_queue.put(None)
+            self._progress_thread.join(timeout=5)
+            self._progress_thread = None
+
+    def _listen_progress(self):
+        while True:
+            item = self._progress_queue.get()
+            if item is None:
+                break
+            token, stage = item
+            callback = self._progress_callbacks.get(token)
+            if callback is not None:
+                try:
+                    callback(stage)
+                except Exception:
+                    logger.warning("Errore nella notifica di avanzamento", exc_info=True)
+
+    def _release(self, memory=0):
+        with self._lock:
+            self._pending -= 1
+        self.memory.release(memory)
+
+    def _release_when_done(self, futures, memory=0):
+        """
+        Libera il posto in coda e la memoria riservata quando tutti i processi
+        del job hanno davvero finito: un job scaduto continua a occupare i
+        suoi worker e va contato.
+        """
+        remaining = [f for f in futures if not f.done()]
+        if not remaining:
+            self._release(memory)
+            return
+
+        counter = {"left": len(remaining)}
+
+        # Chiamato dal thread di gestione del pool, non dall'event loop
+        def done(_future):
+            with self._lock:
+                counter["left"] -= 1
+                last = counter["left"] == 0
+            if last:
+                self._release(memory)
+
+        for f in remaining:
+            f.add_done_callback(done)
+
+    async def _run_job(self, job, memory=0):
+        """
+        Esegue un job composto da uno o più task nel pool. job è una coroutine
+        function che riceve submit(fn, *args) e restituisce il risultato finale.
+        memory è la memoria stimata del job, riservata sul budget prima di
+        partire (in coda finché non si libera).
+        Solleva EngineBusy se la coda è piena o la memoria non si libera in
+        tempo ed EngineTimeout se il job scade.
+        """
+        if self._executor is None:
+            raise RuntimeError("Motore di rendering non avviato")
+
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                raise EngineBusy(self.retry_after)
+            self._pending += 1
+
+        futures = []
+        reserved = 0
+
+        def submit(fn, *args):
+            future = self._executor.submit(fn, *args)
+            futures.append(future)
+            return asyncio.wrap_future(future)
+
+        try:
+            if not await self.memory.acquire(memory, self.job_timeout):
+                raise EngineBusy(self.retry_after)
+            reserved = memory
+            return await asyncio.wait_for(job(submit), timeout=self.job_timeout)
+        except BaseException as e:
+            for future in futures:
+                if not future.cancel():
+                    # Il worker finirà comunque: scartiamo l'eventuale file temporaneo
+                    future.add_done_callback(_discard_result)
+            if isinstance(e, asyncio.TimeoutError):
+                raise EngineTimeout(f"Generazione PDF oltre il limite di {self.job_timeout} secondi")
+            raise
+        finally:
+            self._release_when_done(futures, reserved)
+
+    async def run(self, fn, *args, memory=0):
+        """
+        Esegue fn(*args) in un processo worker e ne restituisce il risultato.
+        memory è la memoria stimata del task (vedi report.estimate_cost):
+        oltre l'intero budget è ReportTooLarge, altrimenti il task attende
+        che sia libera come i report.
+        """
+        self.memory.check(memory)
+
+        async def job(submit):
+            return await submit(fn, *args)
+
+        return await self._run_job(job, memory)
+
+    async def warm_up(self):
+        """
+        Un render di prova per worker (scartato): avvia tutti i processi del
+        pool e ne scalda font, template e codice prima del traffico reale.
+        Restituisce [(pid, secondi), ...].
+        """
+        return await asyncio.gather(*(self.run(report.warm_up) for _ in range(self.workers)))
+
+    def _fragment_key(self, name, data):
+        return canonical_hash(report.section_data(name, data), name, report.RENDER_VERSION, report.fonts_version())
+
+    async def render_report(self, data, progress=None, optimize="fast", template=None, selection=None):
+        """
+        Genera un report completo.
+        - Percorso base: un solo worker disegna tutte le sezioni su un canvas.
+        - Con sezioni in parallelo e/o cache dei frammenti, ogni sezione ha il
+          proprio PDF: quelle già in cache (chiave = soli campi letti dalla
+          sezione) vengono riusate, le altre renderizzate in worker diversi
+          (parallelo) o in un unico task, poi tutto viene unito nell'ordine
+          fisso del layout.
+        - optimize="size" usa sempre il percorso base: i frammenti hanno
+          ciascuno il proprio sottoinsieme dei font, che non si può fondere.
+        template è l'id del template del catalogo (None = predefinito): ne
+        determina sezioni e punti di inserimento. selection (sezioni e/o
+        pagine, vedi report.select_pages) limita il PDF a una parte del
+        report e usa sempre il percorso base.
+        Prima di partire il costo del report (limitato alla selection) viene
+        stimato per eccesso dalla lunghezza dei testi, senza measure pass:
+        oltre l'intero budget di memoria è ReportTooLarge, altrimenti il job
+        attende che la sua memoria sia libera; oltre spool_bytes le sezioni e
+        il PDF vengono scritti su disco (percorso base).
+        I tempi per sezione finiscono in PdfOutput.timings. progress, se
+        presente, viene chiamata con il nome di ogni sezione completata
+        (anche da un thread diverso da quello dell'event loop).
+        """
+        # Stima senza a capo: pochi ms anche su payload enormi, resta sull'event loop
+        cost = report.estimate_cost(data, template, selection)
+        self.memory.check(cost.byte)
+        spool = cost.byte > self.spool_bytes
+        if spool:
+            logger.info(f"Report di {cost.pagine} pagine (~{cost.byte // 2**20} MB): scritto su disco")
+
+        token = None
+        if progress is not None:
+            token = uuid.uuid4().hex
+            self._progress_callbacks[token] = progress
+
+        try:
+            if spool or selection or optimize == "size" or (not self.parallel_sections and not self.fragments.enabled):
+                return await self._run_job(
+                    lambda submit: submit(report.build_report, data, token, optimize, template, selection, spool),
+                    cost.byte,
+                )
+            return await self._run_job(
+                lambda submit: self._render_fragments(submit, data, token, progress, template), cost.byte
+            )
+        finally:
+            self._progress_callbacks.pop(token, None)
+
+    async def _render_fragments(self, submit, data, token, progress, template):
+        sections = report.get_template(template).sections
+        fragments = {}
+        keys = {}
+        if self.fragments.enabled:
+            for name in sections:
+                keys[name] = self._fragment_key(name, data)
+                cached = self.fragments.get(keys[name])
+                metrics.CACHE_REQUESTS.inc(cache="frammenti", esito="miss" if cached is None else "hit")
+                if cached is not None:
+                    fragments[name] = cached
+                    if progress is not None:
+                        progress(name)
+
+        missing = {name: report.section_data(name, data) for name in sections if name not in fragments}
+        if fragments:
+            logger.info(f"Sezioni dalla cache: {', '.join(fragments)}; da renderizzare: {', '.join(missing) or '-'}")
+
+        async def render_one(name, section):
+            result = await submit(report.render_section, name, section)
+            if progress is not None:
+                progress(name)
+            return result
+
+        rendered = {}
+        if missing and self.parallel_sections:
+            results = await asyncio.gather(*(render_one(name, section) for name, section in missing.items()))
+            rendered = dict(zip(missing, results))
+        elif missing:
+            rendered = await submit(report.render_fragments, missing, token)
+
+        timings = {}
+        for name, (pdf_bytes, elapsed) in rendered.items():
+            fragments[name] = pdf_bytes
+            timings[name] = elapsed
+            if self.fragments.enabled:
+                self.fragments.put(keys[name], pdf_bytes)
+
+        return await submit(report.assemble_fragments, fragments, timings, template)
@@ -0,0 +1,297 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# Stati di un job
+IN_CODA = "in_coda"
+IN_CORSO = "in_corso"
+COMPLETATO = "completato"
+ERRORE = "errore"
+
+
+class JobStoreFull(Exception):
+    """Troppi job in attesa: la richiesta va rifiutata."""
+
+
+class MemoryJobStore:
+    """
+    Job e risultati in memoria: vanno persi al riavvio del processo.
+    I PDF conservati occupano al massimo max_result_bytes: oltre, i risultati
+    più vecchi vengono scartati prima della scadenza del job.
+    """
+
+    def __init__(self, max_result_bytes=None):
+        if max_result_bytes is None:
+            max_result_bytes = int(os.environ.get("PDF_JOB_RESULTS_MAX_BYTES", 256 * 1024 * 1024))
+        self.max_result_bytes = max_result_bytes
+        self._jobs = {}
+        self._results = {}
+        self._result_bytes = 0
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job, sezioni=dict(job["sezioni"])) if job is not None else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+                job["aggiornato"] = time.time()
+
+    def section_done(self, job_id, section):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and section in job["sezioni"]:
+                job["sezioni"][section] = True
+                job["aggiornato"] = time.time()
+
+    def put_result(self, job_id, data):
+        if len(data) > self.max_result_bytes:
+            logger.warning(f"Risultato del job {job_id} non conservato: {len(data)} byte (max {self.max_result_bytes})")
+            return
+        with self._lock:
+            self._drop_result(job_id)
+            # I dict mantengono l'ordine di inserimento: i primi sono i più vecchi
+            while self._results and self._result_bytes + len(data) > self.max_result_bytes:
+                oldest = next(iter(self._results))
+                self._drop_result(oldest)
+                logger.info(f"Risultato del job {oldest} scartato: limite di memoria dei job raggiunto")
+            self._results[job_id] = data
+            self._result_bytes += len(data)
+
+    def _drop_result(self, job_id):
+        data = self._results.pop(job_id, None)
+        if data is not None:
+            self._result_bytes -= len(data)
+
+    def get_result(self, job_id):
+        with self._lock:
+            return self._results.get(job_id)
+
+    def count_active(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job["stato"] in (IN_CODA, IN_CORSO))
+
+    def purge(self, now):
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job["scade"] is not None and job["scade"] <= now]
+            for job_id in expired:
+                del self._jobs[job_id]
+                self._drop_result(job_id)
+            return len(expired)
+
+
+class SQLiteJobStore:
+    """
+    Job e risultati su SQLite: sopravvivono al riavvio e sono visibili a tutti
+    i processi uvicorn che condividono lo stesso file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, stato TEXT NOT NULL, job TEXT NOT NULL,"
+            " scade REAL, risultato BLOB)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_scade ON jobs (scade)")
+
+    def create(self, job):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, stato, job, scade) VALUES (?, ?, ?, ?)",
+                (job["id"], job["stato"], json.dumps(job), job["scade"]),
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT job FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def _modify(self, job_id, change):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT job FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row is not None:
+                    job = json.loads(row[0])
+                    change(job)
+                    job["aggiornato"] = time.time()
+                    self._conn.execute(
+                        "UPDATE jobs SET stato = ?, job = ?, scade = ? WHERE id = ?",
+                        (job["stato"], json.dumps(job), job["scade"], job_id),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def update(self, job_id, **fields):
+        self._modify(job_id, lambda job: job.update(fields))
+
+    def section_done(self, job_id, section):
+        def change(job):
+            if section in job["sezioni"]:
+                job["sezioni"][section] = True
+
+        self._modify(job_id, change)
+
+    def put_result(self, job_id, data):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET risultato = ? WHERE id = ?", (data, job_id))
+
+    def get_result(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT risultato FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def count_active(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE stato IN (?, ?)", (IN_CODA, IN_CORSO)
+            ).fetchone()
+        return row[0]
+
+    def purge(self, now):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM jobs WHERE scade IS NOT NULL AND scade <= ?", (now,))
+        return cursor.rowcount
+
+
+def make_store():
+    """Backend scelto con PDF_JOB_BACKEND (memory | sqlite, file in PDF_JOB_DB)."""
+    backend = os.environ.get("PDF_JOB_BACKEND", "memory").lower()
+    if backend == "sqlite":
+        return SQLiteJobStore(os.environ.get("PDF_JOB_DB", "jobs.sqlite3"))
+    if backend != "memory":
+        raise ValueError(f"Backend job sconosciuto: {backend}")
+    return MemoryJobStore()
+
+
+class JobManager:
+    """
+    Coda locale di job asincroni: il client riceve subito un id, il rendering
+    avviene in background (al massimo `concurrency` job alla volta, gli altri
+    restano in coda) e stato/risultato si leggono in seguito.
+    I job conclusi vengono rimossi dopo `ttl` secondi. Le operazioni sullo
+    store (SQLite può attendere un lock fino a 5 secondi) girano in un
+    thread, mai sull'event loop.
+    render è chiamata come render(data, progress, **options), con le opzioni
+    passate a submit (es. il template).
+    """
+
+    def __init__(self, render, sections, store=None, concurrency=1, max_active=None, ttl=None):
+        self.render = render
+        self.sections = list(sections)
+        self.store = store or make_store()
+        self.concurrency = concurrency
+        self.max_active = max_active if max_active is not None else int(os.environ.get("PDF_JOB_MAX_ACTIVE", 1000))
+        self.ttl = ttl if ttl is not None else float(os.environ.get("PDF_JOB_TTL", 3600))
+        self._semaphore = None
+        self._tasks = set()
+        self._purger = None
+
+    def start(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._purger = asyncio.create_task(self._purge_loop())
+
+    async def stop(self):
+        if self._purger is not None:
+            self._purger.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def submit(self, data, filename, sections=None, **options):
+        if await asyncio.to_thread(self.store.count_active) >= self.max_active:
+            raise JobStoreFull(f"Troppi job in coda (max {self.max_active})")
+
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "stato": IN_CODA,
+            "sezioni": {name: False for name in (sections or self.sections)},
+            "file": filename,
+            "byte": None,
+            "errore": None,
+            "creato": now,
+            "aggiornato": now,
+            # Anche un job mai completato (es. processo riavviato) prima o poi scade
+            "scade": now + self.ttl + 24 * 3600,
+        }
+        await asyncio.to_thread(self.store.create, job)
+
+        self._spawn(self._run(job["id"], data, list(job["sezioni"]), options))
+        return job
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _progress(self, job_id, loop):
+        """
+        Callback di avanzamento del job: il motore la chiama dal proprio thread
+        di avanzamento oppure, per le sezioni prese dalla cache, dall'event loop.
+        """
+        def progress(section):
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is loop:
+                self._spawn(asyncio.to_thread(self.store.section_done, job_id, section))
+            else:
+                self.store.section_done(job_id, section)
+
+        return progress
+
+    async def _run(self, job_id, data, sections, options):
+        async with self._semaphore:
+            await asyncio.to_thread(self.store.update, job_id, stato=IN_CORSO)
+            try:
+                pdf_bytes = await self.render(data, self._progress(job_id, asyncio.get_running_loop()), **options)
+            except Exception as e:
+                logger.warning(f"Job {job_id} fallito: {str(e)}")
+                await asyncio.to_thread(
+                    self.store.update, job_id, stato=ERRORE, errore=str(e), scade=time.time() + self.ttl
+                )
+                return
+
+            await asyncio.to_thread(self.store.put_result, job_id, pdf_bytes)
+            await asyncio.to_thread(
+                self.store.update,
+                job_id,
+                stato=COMPLETATO,
+                byte=len(pdf_bytes),
+                sezioni={name: True for name in sections},
+                scade=time.time() + self.ttl,
+            )
+            logger.info(f"Job {job_id} completato ({len(pdf_bytes)} byte)")
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(min(60, max(1, self.ttl / 10)))
+            try:
+                removed = await asyncio.to_thread(self.store.purge, time.time())
+                if removed:
+                    logger.info(f"Job scaduti rimossi: {removed}")
+            except Exception:
+                logger.warning("Errore nella pulizia dei job scaduti", exc_info=True)
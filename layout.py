@@ -0,0 +1,266 @@
+import math
+from collections import namedtuple
+from dataclasses import dataclass
+from functools import lru_cache
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+from linebreak import wrap_lines
+
+
+# Stile di una riga di testo: font registrato e dimensione in punti
+TextStyle = namedtuple("TextStyle", ["font", "size"])
+
+# Voce di una sezione: titoletto in grassetto (opzionale) e paragrafi sotto
+Item = namedtuple("Item", ["heading", "paragraphs"])
+
+# Operazione di disegno prodotta dal measure pass
+Line = namedtuple("Line", ["style", "x", "y", "text"])
+
+HEADING = TextStyle("Montserrat-Bold", 29.2)
+BODY = TextStyle("Montserrat-Regular", 29.2)
+
+
+def split_items(value):
+    """Voci di un campo a elenco: lista già pronta (vedi schema.py) o stringa separata da |."""
+    if isinstance(value, list):
+        return value
+    return value.split("|") if value else []
+
+
+class Pairs:
+    """
+    Voci separate da | in data[key], ognuna con la spiegazione nella stessa
+    posizione di data[notes_key] (es. benefici_prodotti / spiegazione_benefici_prodotti).
+    """
+
+    def __init__(self, key, notes_key):
+        self.key = key
+        self.notes_key = notes_key
+
+    @property
+    def fields(self):
+        return (self.key, self.notes_key)
+
+    def items(self, data):
+        notes = split_items(data.get(self.notes_key, ""))
+        items = []
+        for idx, value in enumerate(split_items(data.get(self.key, ""))):
+            note = notes[idx].strip() if idx < len(notes) else ""
+            items.append(Item(f"- {value.strip()}", [note] if note else []))
+        return items
+
+
+class Labelled:
+    """
+    Campi fissi di un oggetto data[key], mostrati con la propria etichetta.
+    labels è una lista di (campo, etichetta); con split=True il valore può
+    contenere più paragrafi separati da |.
+    """
+
+    def __init__(self, key, labels, split=False):
+        self.key = key
+        self.labels = labels
+        self.split = split
+
+    @property
+    def fields(self):
+        return (self.key,)
+
+    def items(self, data):
+        group = data.get(self.key, {})
+        items = []
+        for field, label in self.labels:
+            value = group.get(field, "")
+            if self.split:
+                paragraphs = [part.strip() for part in split_items(value) if part.strip()]
+            else:
+                paragraphs = [value]
+            items.append(Item(f"- {label}", paragraphs))
+        return items
+
+
+class Bullets:
+    """Elenco puntato senza titoletti: voci separate da | in data[key], vuote escluse."""
+
+    def __init__(self, key):
+        self.key = key
+
+    @property
+    def fields(self):
+        return (self.key,)
+
+    def items(self, data):
+        return [Item(None, [f"- {value.strip()}"]) for value in split_items(data.get(self.key, "")) if value.strip()]
+
+
+class Fixed:
+    """
+    Testi fissi: blocks è una lista di (titoletto, testo), dove il testo può
+    usare i campi di data come segnaposto (es. "{sito_web}"); defaults
+    fornisce i valori dei campi mancanti.
+    """
+
+    def __init__(self, blocks, defaults):
+        self.blocks = blocks
+        self.defaults = defaults
+
+    @property
+    def fields(self):
+        return tuple(self.defaults)
+
+    def items(self, data):
+        values = {field: data.get(field, default) for field, default in self.defaults.items()}
+        return [Item(heading, [text.format(**values)]) for heading, text in self.blocks]
+
+
+@dataclass(frozen=True)
+class SectionSpec:
+    """
+    Descrizione dichiarativa di una sezione del report.
+    - title: sottotitolo ripetuto su ogni pagina della sezione
+    - source: da dove vengono le voci (Pairs, Labelled, Bullets, Fixed)
+    - per_page: voci al massimo per pagina (None = solo a fine spazio)
+    - heading / body: stili del titoletto e dei paragrafi
+    - heading_indent / body_indent: margine sinistro di titoletti e paragrafi
+    - line_height: interlinea; item_gap: spazio dopo ogni voce
+    """
+    title: str
+    source: object
+    per_page: int = None
+    heading: TextStyle = HEADING
+    body: TextStyle = BODY
+    heading_indent: float = 100
+    body_indent: float = 120
+    line_height: float = 36
+    item_gap: float = 30
+
+    @property
+    def fields(self):
+        return self.source.fields
+
+
+def measure(spec, data, page_size, top=300, bottom=60, margin=200):
+    """
+    Measure pass: calcola a capo e interruzioni di pagina della sezione senza
+    disegnare nulla. Restituisce una lista di pagine, ognuna lista di Line
+    (almeno una pagina, anche se la sezione è vuota).
+    - top: distanza dal bordo superiore della prima riga di ogni pagina
+    - bottom: sotto questa quota si passa alla pagina successiva
+    - margin: spazio orizzontale totale escluso dalla larghezza del testo
+    """
+    page_width, page_height = page_size
+    width = page_width - margin
+    start_y = page_height - top
+
+    pages = [[]]
+    state = {"y": start_y, "count": 0}
+
+    def new_page():
+        pages.append([])
+        state["y"] = start_y
+        state["count"] = 0
+
+    def emit(style, x, text):
+        if state["y"] < bottom:
+            new_page()
+        pages[-1].append(Line(style, x, state["y"], text))
+        state["y"] -= spec.line_height
+
+    for item in spec.source.items(data):
+        if spec.per_page is not None and state["count"] >= spec.per_page:
+            new_page()
+
+        if item.heading is not None:
+            emit(spec.heading, spec.heading_indent, item.heading)
+        for paragraph in item.paragraphs:
+            for line in wrap_lines(paragraph, spec.body.font, spec.body.size, width):
+                emit(spec.body, spec.body_indent, line)
+
+        state["y"] -= spec.item_gap
+        state["count"] += 1
+
+    return pages
+
+
+# Percentile delle larghezze dei glifi usato per stimare gli a capo: una
+# larghezza per eccesso tiene la stima sopra measure anche con testi in
+# maiuscolo o pieni di lettere larghe (vedi estimate_pages)
+CHAR_WIDTH_PERCENTILE = 0.95
+
+
+@lru_cache(maxsize=None)
+def char_width(font):
+    """
+    Larghezza in em di un carattere del font al percentile
+    CHAR_WIDTH_PERCENTILE, tra i caratteri Latin-1 stampabili.
+    """
+    widths = sorted(stringWidth(chr(code), font, 1) for code in range(32, 256) if chr(code).isprintable())
+    return widths[min(len(widths) - 1, int(len(widths) * CHAR_WIDTH_PERCENTILE))]
+
+
+def estimate_pages(spec, data, page_size, top=300, bottom=60, margin=200):
+    """
+    Stima veloce (per eccesso) del numero di pagine che measure produrrebbe:
+    le righe di ogni paragrafo sono ricavate dalla sua lunghezza e da una
+    larghezza dei caratteri conservativa (char_width), senza wrap_lines.
+    Stessi parametri di measure.
+    """
+    page_width, page_height = page_size
+    chars_per_line = max(1, int((page_width - margin) / (spec.body.size * char_width(spec.body.font))))
+    start_y = page_height - top
+    lines_per_page = int((start_y - bottom) // spec.line_height) + 1
+
+    pages = 1
+    state = {"lines": 0, "gaps": 0.0, "count": 0}
+    for item in spec.source.items(data):
+        if spec.per_page is not None and state["count"] >= spec.per_page:
+            pages += 1
+            state.update(lines=0, gaps=0.0, count=0)
+
+        lines = 1 if item.heading is not None else 0
+        lines += sum(max(1, -(-len(paragraph) // chars_per_line)) for paragraph in item.paragraphs)
+        while lines:
+            used = state["lines"] + math.ceil(state["gaps"] / spec.line_height)
+            free = max(0, lines_per_page - used)
+            if free == 0:
+                pages += 1
+                state.update(lines=0, gaps=0.0, count=0)
+                continue
+            taken = min(free, lines)
+            state["lines"] += taken
+            lines -= taken
+
+        state["gaps"] += spec.item_gap
+        state["count"] += 1
+    return pages
+
+
+def paint(c, pages, begin_page, line_height):
+    """
+    Paint pass: disegna le pagine calcolate da measure. begin_page(c) disegna
+    gli elementi fissi (sfondo, intestazione, sottotitolo) di ogni pagina;
+    ogni pagina viene chiusa con showPage.
+
+    Le righe di una pagina formano un unico oggetto di testo (BT ... ET): il
+    font viene impostato solo quando cambia stile, le righe distanti
+    line_height (l'interlinea della sezione) scendono con T* e le altre con
+    uno spostamento relativo (Td), senza riposizionare il testo ogni volta.
+    """
+    for lines in pages:
+        begin_page(c)
+        if lines:
+            text = c.beginText(lines[0].x, lines[0].y)
+            # Inizio della riga successiva nell'oggetto di testo
+            x, y = lines[0].x, lines[0].y
+            style = None
+            for line in lines:
+                if (line.x, line.y) != (x, y):
+                    text.moveCursor(line.x - x, y - line.y)
+                if line.style != style:
+                    style = line.style
+                    text.setFont(style.font, style.size, line_height)
+                text.textLine(line.text)
+                x, y = line.x, line.y - line_height
+            c.drawText(text)
+        c.showPage()
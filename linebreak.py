@@ -0,0 +1,81 @@
+import os
+from functools import lru_cache
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+
+# Paragrafi già spezzati tenuti in memoria (per processo worker)
+WRAP_CACHE_SIZE = int(os.environ.get("PDF_WRAP_CACHE_SIZE", 4096))
+
+# Parole di cui ricordare la larghezza, per font e dimensione
+WORD_CACHE_SIZE = int(os.environ.get("PDF_WORD_CACHE_SIZE", 20000))
+
+
+class LineBreaker:
+    """
+    A capo del testo con lo stesso algoritmo di reportlab simpleSplit (stesse
+    righe, a parità di font e larghezza), ma con due livelli di memoizzazione:
+    - larghezza di ogni parola, per (font, dimensione): le parole si ripetono
+      molto più dei paragrafi, quindi stringWidth viene chiamata di rado
+    - risultato completo per (testo, font, dimensione, larghezza), con
+      eviction LRU: i testi fissi (es. sezione competitor) e i paragrafi
+      ripetuti tra un report e l'altro non vengono più misurati
+    """
+
+    def __init__(self, max_entries=WRAP_CACHE_SIZE, max_words=WORD_CACHE_SIZE):
+        self.max_words = max_words
+        self._widths = {}
+        self.wrap = lru_cache(maxsize=max_entries)(self._wrap)
+
+    def _word_widths(self, font, size):
+        widths = self._widths.get((font, size))
+        if widths is None or len(widths) >= self.max_words:
+            widths = self._widths[(font, size)] = {}
+        return widths
+
+    def _wrap(self, text, font, size, width):
+        widths = self._word_widths(font, size)
+        space = widths.get(" ")
+        if space is None:
+            space = widths[" "] = stringWidth(" ", font, size)
+
+        lines = []
+        for paragraph in text.split("\n"):
+            current = []
+            w = -space
+            for word in paragraph.split():
+                word_width = widths.get(word)
+                if word_width is None:
+                    word_width = widths[word] = stringWidth(word, font, size)
+                if w + space + word_width <= width or not current:
+                    current.append(word)
+                    w = w + space + word_width
+                else:
+                    lines.append(" ".join(current))
+                    current = [word]
+                    w = word_width
+            if current:
+                lines.append(" ".join(current))
+        return tuple(lines)
+
+    def stats(self):
+        info = self.wrap.cache_info()
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "paragrafi": info.currsize,
+            "parole": sum(len(widths) for widths in self._widths.values()),
+        }
+
+    def clear(self):
+        self.wrap.cache_clear()
+        self._widths.clear()
+
+
+# Istanza condivisa dal processo
+breaker = LineBreaker()
+
+
+def wrap_lines(text, font, size, width):
+    """Righe di text che stanno in width punti (tupla, da non modificare)."""
+    return breaker.wrap(text, font, size, width)
@@ -0,0 +1,160 @@
+import os
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+
+from cache import canonical_hash
+
+
+# Configurazione (variabili d'ambiente)
+LOG_LEVEL = os.environ.get("PDF_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("PDF_LOG_FORMAT", "text").lower()        # text | json
+LOG_QUEUE = os.environ.get("PDF_LOG_QUEUE", "1").lower() in ("1", "true", "yes")
+PAYLOAD_SAMPLE_RATE = float(os.environ.get("PDF_LOG_PAYLOAD_SAMPLE", 0.01))
+PAYLOAD_MAX_CHARS = int(os.environ.get("PDF_LOG_PAYLOAD_MAX_CHARS", 500))
+
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+# Attributi standard di LogRecord: tutto il resto arriva da extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+class PayloadSummary:
+    """
+    Descrizione compatta di un payload: hash, dimensione, campi e anteprima
+    troncata. Viene calcolata solo se il record di log viene davvero emesso
+    (livello attivo e campionamento superato), mai per le richieste scartate.
+    """
+
+    def __init__(self, data, max_chars=None):
+        self.data = data
+        self.max_chars = PAYLOAD_MAX_CHARS if max_chars is None else max_chars
+        self._summary = None
+
+    def as_dict(self):
+        if self._summary is None:
+            text = json.dumps(self.data, ensure_ascii=False, default=str)
+            preview = text if len(text) <= self.max_chars else text[:self.max_chars] + "…"
+            self._summary = {
+                "hash": canonical_hash(self.data)[:16],
+                "byte": len(text.encode("utf-8")),
+                "campi": sorted(self.data) if isinstance(self.data, dict) else None,
+                "anteprima": preview,
+            }
+        return self._summary
+
+    def __str__(self):
+        summary = self.as_dict()
+        return f"hash={summary['hash']} byte={summary['byte']} anteprima={summary['anteprima']}"
+
+
+class SampleFilter(logging.Filter):
+    """Lascia passare solo una frazione (rate, da 0 a 1) dei record del logger."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return self.rate >= 1 or random.random() < self.rate
+
+
+def _extras(record):
+    """Campi passati con extra= al momento del log."""
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS and not key.startswith("_")}
+
+
+class TextFormatter(logging.Formatter):
+    """Formato testuale classico, con gli eventuali campi extra in coda (chiave=valore)."""
+
+    def format(self, record):
+        text = super().format(record)
+        extras = _extras(record)
+        if extras:
+            text += " " + " ".join(f"{key}=[{value}]" for key, value in extras.items())
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """Un oggetto JSON per riga, con i campi passati in extra= al primo livello."""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "livello": record.levelname,
+            "logger": record.name,
+            "messaggio": record.getMessage(),
+        }
+        for key, value in _extras(record).items():
+            entry[key] = value.as_dict() if hasattr(value, "as_dict") else value
+        if record.exc_info:
+            entry["eccezione"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["eccezione"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Come QueueHandler, ma lascia il traceback in exc_text invece di unirlo al
+    messaggio: il formatter JSON lo mette così nel proprio campo.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level=None, fmt=None, use_queue=None):
+    """
+    Configura il logger radice del processo (principale o worker).
+    Con use_queue i record vengono solo accodati: formattazione e scrittura
+    avvengono in un thread separato, così una destinazione lenta (stdout
+    rediretto, raccolta log della piattaforma) non rallenta le richieste.
+    """
+    global _listener
+    level = level or LOG_LEVEL
+    fmt = fmt or LOG_FORMAT
+    use_queue = LOG_QUEUE if use_queue is None else use_queue
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.setLevel(level)
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    if use_queue:
+        records = queue.SimpleQueue()
+        root.addHandler(_QueueHandler(records))
+        _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+        _listener.start()
+    else:
+        root.addHandler(handler)
+
+    # Payload dei client: campionati e mai completi (vedi PayloadSummary)
+    payload_logger = logging.getLogger("payload")
+    payload_logger.filters = [SampleFilter(PAYLOAD_SAMPLE_RATE)]
+
+
+@atexit.register
+def _stop_listener():
+    # Svuota la coda all'uscita del processo
+    if _listener is not None:
+        _listener.stop()
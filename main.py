@@ -1,752 +1,554 @@
+import time
+
+# Tempo di import dei moduli dell'applicazione (font compresi), loggato all'avvio
+_import_start = time.perf_counter()
+
 import os
 import io
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+import re
+import json
+import asyncio
+import zipfile
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from typing import Optional
 import logging
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import landscape, A4
-from reportlab.lib.utils import simpleSplit
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.enums import TA_LEFT
-from reportlab.lib.colors import HexColor, Color
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from PyPDF2 import PdfReader, PdfWriter
 
+import batch
+import jobs
+import logs
+import metrics
+import optimize
+import preview
+import report
+import schema
+from cache import ResultCache
+from output import PdfOutput, content_digest
+from engine import RenderEngine, EngineBusy, EngineTimeout, ReportTooLarge
 
 
-# Registra i font Montserrat
-pdfmetrics.registerFont(TTFont("Montserrat-Regular", "fonts/Montserrat-Regular.ttf", subfontIndex=0))
-pdfmetrics.registerFont(TTFont("Montserrat-Bold", "fonts/Montserrat-Bold.ttf", subfontIndex=0))
-pdfmetrics.registerFont(TTFont("Montserrat-ExtraBold", "fonts/Montserrat-ExtraBold.ttf", subfontIndex=0))
 
+IMPORT_SECONDS = time.perf_counter() - _import_start
 
-# Imposta il logger
-logging.basicConfig(level=logging.INFO)
+# Imposta il logger (formato, livello e coda: vedi logs.py)
+logs.setup_logging()
 logger = logging.getLogger(__name__)
+payload_logger = logging.getLogger("payload")
 
-app = FastAPI()
+# Motore di rendering (pool di processi), configurabile via variabili d'ambiente
+engine = RenderEngine()
 
-# Definiamo il modello di input
-class PdfRequest(BaseModel):
-    data: dict
+# Cache dei PDF già generati (chiave: hash dei dati + versioni template/font)
+result_cache = ResultCache()
 
-@app.get("/")
-def home():
-    return {"message": "PDF Service is running with ReportLab 🚀"}
+# Limiti dell'endpoint batch
+BATCH_MAX_ITEMS = int(os.environ.get("PDF_BATCH_MAX_ITEMS", 1000))
+BATCH_BUSY_RETRIES = int(os.environ.get("PDF_BATCH_BUSY_RETRIES", 10))
+# Pagine al massimo in una selezione ?pages= (ben oltre qualsiasi report reale)
+MAX_SELECTED_PAGES = int(os.environ.get("PDF_MAX_SELECTED_PAGES", 10000))
 
+# Warm-up all'avvio: "wait" (default) blocca l'avvio finché i worker non sono
+# pronti, "background" accetta subito le connessioni ma /ready risponde 503
+# fino alla fine del warm-up, "off" lo disattiva
+WARMUP_MODE = os.environ.get("PDF_WARMUP", "wait").lower()
 
+# Stato esposto da /ready
+readiness = {"stato": "avvio", "errore": None}
 
-def draw_page_header(c):
-    # Titolo principale
-    c.setFont("Montserrat-ExtraBold", 80)
-    c.drawString(100, 675, "ANALISI DI MERCATO")
 
-def draw_vertical_gradient(c, width, height, top_color, mid_color, bottom_color, steps=200):
+async def warm_up():
     """
-    Disegna un gradiente verticale (90°) da top → mid → bottom.
+    Prepara il servizio prima del traffico: versioni di font e template nel
+    processo principale (servono alle chiavi di cache) e un render di prova
+    in ogni worker del motore.
     """
-    for i in range(steps):
-        ratio = i / (steps - 1)
-        if ratio < 0.5:
-            local_ratio = ratio / 0.5
-            r = top_color.red + (mid_color.red - top_color.red) * local_ratio
-            g = top_color.green + (mid_color.green - top_color.green) * local_ratio
-            b = top_color.blue + (mid_color.blue - top_color.blue) * local_ratio
-        else:
-            local_ratio = (ratio - 0.5) / 0.5
-            r = mid_color.red + (bottom_color.red - mid_color.red) * local_ratio
-            g = mid_color.green + (bottom_color.green - mid_color.green) * local_ratio
-            b = mid_color.blue + (bottom_color.blue - mid_color.blue) * local_ratio
-
-        c.setFillColor(Color(r, g, b))
-        y = int(height * ratio)
-        c.rect(0, y, width, height / steps + 1, stroke=0, fill=1)
-
-
-
-
-def render_section_to_buffer(section_title, draw_func):
-    """
-    Crea un buffer PDF per una singola sezione.
-    - section_title: titolo/sottotitolo della sezione
-    - draw_func: funzione che accetta (canvas, page_width, page_height) e disegna il contenuto
-    """
-    section_buffer = io.BytesIO()
-    c = canvas.Canvas(section_buffer, pagesize=(1440, 810))
-
-    # Colori gradiente
-    top = HexColor("#000000")
-    mid = HexColor("#001373")
-    bottom = HexColor("#000000")
-    white = HexColor("#FFFFFF")
-
-    # Sfondo gradiente
-    draw_vertical_gradient(c, 1440, 810, top, mid, bottom)
-
-    # Header
-    c.setFillColor(white)
-    draw_page_header(c)
+    t0 = time.perf_counter()
+    try:
+        await run_in_threadpool(report.render_version)
+        workers = await engine.warm_up()
+    except Exception as e:
+        logger.error(f"Warm-up fallito: {str(e)}", exc_info=True)
+        readiness.update(stato="errore", errore=str(e))
+        return
+
+    readiness["stato"] = "pronto"
+    logger.info(
+        f"Warm-up completato in {(time.perf_counter() - t0) * 1000:.1f} ms: "
+        + ", ".join(f"worker {pid} {sec * 1000:.1f} ms" for pid, sec in workers)
+    )
 
-    # Sottotitolo
-    if section_title:
-        c.setFont("Montserrat-Regular", 26)
-        c.drawString(100, 626, section_title.upper())
 
-    # Disegna contenuto personalizzato
-    draw_func(c, 1440, 810)
+@asynccontextmanager
+async def lifespan(app):
+    logger.info(
+        f"Import dei moduli: {IMPORT_SECONDS * 1000:.1f} ms "
+        f"(di cui font {report.FONT_LOAD_SECONDS * 1000:.1f} ms)"
+    )
+    diagnostics = report.template_diagnostics()
+    level = logging.INFO if diagnostics["esiste"] else logging.WARNING
+    logger.log(level, "Diagnostica template", extra={"diagnostica": diagnostics})
 
-    # Salva il buffer
-    c.save()
-    section_buffer.seek(0)
-    return section_buffer
+    t0 = time.perf_counter()
+    engine.start()
+    job_manager.start()
+    logger.info(f"Motore avviato in {(time.perf_counter() - t0) * 1000:.1f} ms")
 
+    warmup_task = None
+    if WARMUP_MODE == "wait":
+        await warm_up()
+    elif WARMUP_MODE == "background":
+        warmup_task = asyncio.create_task(warm_up())
+    else:
+        readiness["stato"] = "pronto"
 
-@app.post("/generate-pdf")
-async def generate_pdf(body: PdfRequest):
-    logger.info(f"Dati ricevuti per la generazione del PDF: {body.data}")
-
-    buffer = io.BytesIO()
-    
-    # Funzione per disegnare chiavi e valori con wrapping del testo
-    def draw_key_value(c, x, y, key, value, max_width):
-        c.setFont("Montserrat-Bold", 12)
-        c.drawString(x, y, key)
-        c.setFont("Montserrat-Regular", 12)
-        
-        # Calcola la larghezza disponibile per il testo del valore
-        value_x_start = x + c.stringWidth(key, "Montserrat-Bold", 12) + 5
-        value_width = max_width - (value_x_start - x)
-        
-        # Suddividi il testo in righe che si adattano alla larghezza
-        text_lines = simpleSplit(value, "Montserrat-Regular", 12, value_width)
-        
-        current_y = y
-        for line in text_lines:
-            current_y = check_and_new_page(c, current_y)
-            c.drawString(value_x_start, current_y, line)
-            current_y -= 15
-
-        
-        return current_y
-
-    # Funzione per disegnare un paragrafo con wrapping del testo
-    def draw_paragraph(c, x, y, text, max_width, font_size=12, leading=14):
-        c.setFont("Montserrat-Regular", font_size)
-        text_lines = simpleSplit(text, "Montserrat-Regular", font_size, max_width)
-        
-        current_y = y
-        for line in text_lines:
-            current_y = check_and_new_page(c, current_y)
-            c.drawString(x, current_y, line)
-            current_y -= leading
-
-        
-        return current_y
-
-
-
-
-
- 
-
-    
-    def draw_page_layout(c, subtitle):
-        # Titolo principale
-        c.setFont("Montserrat-ExtraBold", 80)
-        c.setFillColor(white)
-        c.drawString(100, 675, "ANALISI DI MERCATO")
-
-        # Sottotitolo dinamico
-        c.setFont("Montserrat-Regular", 26)
-        c.drawString(100, 626, subtitle.upper())
-
-    # Funzione per disegnare una sezione con titolo e contenuto
-    def draw_section(c, x, y, title, content, max_width):
-        c.setFont("Montserrat-Bold", 14)
-        c.setFillColor(HexColor("#4a4a4a"))
-        c.drawString(x, y, title)
-
-      
-
-    
-
-
-
-    # Dimensioni della pagina 16:9 in punti (da 1440x810 px, a 96 DPI)
-    page_size = (1440, 810)
-    c = canvas.Canvas(buffer, pagesize=page_size)
-
-    # Posizionamento
-    page_width, page_height = page_size
-
-    # Colori gradiente
-    top = HexColor("#000000")      # nero
-    mid = HexColor("#001373")      # blu
-    bottom = HexColor("#000000")   # nero
-
-    # Disegna sfondo gradiente
-    draw_vertical_gradient(c, page_width, page_height, top, mid, bottom)
-
-    # Stili di base e colori
-    white = HexColor("#FFFFFF")
-
-    
-    margin = 81           # ≈ 144
-    bottom_margin = 60     # ≈ 106
-    col_width = 450
-    col_x_pos = margin
-    content_x_pos = col_x_pos + col_width + margin
-    y_pos = page_height - margin
-
-    def check_and_new_page(c, current_y, subtitle=None):
-        if current_y < bottom_margin:
-            c.showPage()
-            draw_vertical_gradient(c, page_width, page_height, top, mid, bottom)
-            c.setFillColor(white)
-            draw_page_header(c)  # aggiunge titolo fisso
-
-            
-            
-            # Se è stato passato un sottotitolo, ridisegnalo
-            if subtitle:
-                c.setFont("Montserrat-Regular", 26)
-                c.drawString(100, 626, subtitle.upper())
-            
-            return page_height - 300  # riparte sotto il paragrafo fisso
-            
-        return current_y
-
-
-    def draw_benefici_section(c, page_width, page_height, data):
-        benefici_raw = data.get("benefici_prodotti", "")
-        benefici_list = benefici_raw.split("|") if benefici_raw else []
-
-        spiegazione_raw = data.get("spiegazione_benefici_prodotti", "")
-        spiegazione_list = spiegazione_raw.split("|") if spiegazione_raw else []
-
-        y_pos = page_height - 300
-        count = 0  # contatore benefici nella pagina
-        max_per_page = 2
-
-        for idx, beneficio in enumerate(benefici_list):
-            beneficio = beneficio.strip()
-            spiegazione = spiegazione_list[idx].strip() if idx < len(spiegazione_list) else ""
-
-            # Se ho già stampato 2 benefici, forzo nuova pagina
-            if count >= max_per_page:
-                c.showPage()
-                draw_vertical_gradient(c, page_width, page_height, HexColor("#000000"), HexColor("#001373"), HexColor("#000000"))
-                c.setFillColor(HexColor("#FFFFFF"))
-                draw_page_header(c)
-                c.setFont("Montserrat-Regular", 26)
-                c.drawString(100, 626, "BENEFICI PER IL CLIENTE")
-                y_pos = page_height - 300
-                count = 0
-
-            # Disegna beneficio
-            c.setFont("Montserrat-Bold", 29.2)
-            text_beneficio = f"- {beneficio}"
-            c.drawString(100, y_pos, text_beneficio)
-            y_pos -= 36
-
-            # Disegna spiegazione
-            if spiegazione:
-                c.setFont("Montserrat-Regular", 29.2)
-                text_lines = simpleSplit(spiegazione, "Montserrat-Regular", 29.2, page_width - 200)
-                for line in text_lines:
-                    y_pos = check_and_new_page(c, y_pos, subtitle="BENEFICI PER IL CLIENTE")
-                    c.drawString(120, y_pos, line)
-                    y_pos -= 36
-
-            y_pos -= 30
-            count += 1
-    
-    def draw_bisogni_section(c, page_width, page_height, data):
-        bisogni_raw = data.get("bisogni_robbins", "")
-        bisogni_list = bisogni_raw.split("|") if bisogni_raw else []
-
-        spieg_bisogni_raw = data.get("spiegazione_bisogni_robbins", "")
-        spieg_bisogni_list = spieg_bisogni_raw.split("|") if spieg_bisogni_raw else []
-
-        y_pos = page_height - 300
-        count = 0
-        max_per_page = 2
-
-        for idx, bisogno in enumerate(bisogni_list):
-            bisogno = bisogno.strip()
-            spiegazione = spieg_bisogni_list[idx].strip() if idx < len(spieg_bisogni_list) else ""
-
-            if count >= max_per_page:
-                c.showPage()
-                draw_vertical_gradient(c, page_width, page_height, HexColor("#000000"), HexColor("#001373"), HexColor("#000000"))
-                c.setFillColor(HexColor("#FFFFFF"))
-                draw_page_header(c)
-                c.setFont("Montserrat-Regular", 26)
-                c.drawString(100, 626, "BISOGNI PRIMARI (SECONDO LA TEORIA DI ROBBINS)")
-                y_pos = page_height - 300
-                count = 0
-
-            c.setFont("Montserrat-Bold", 29.2)
-            c.drawString(100, y_pos, f"- {bisogno}")
-            y_pos -= 36
-
-            if spiegazione:
-                c.setFont("Montserrat-Regular", 29.2)
-                text_lines = simpleSplit(spiegazione, "Montserrat-Regular", 29.2, page_width - 200)
-                for line in text_lines:
-                    y_pos = check_and_new_page(c, y_pos, subtitle="BISOGNI PRIMARI (SECONDO LA TEORIA DI ROBBINS)")
-                    c.drawString(120, y_pos, line)
-                    y_pos -= 36
-
-            y_pos -= 30
-            count += 1
-
-    def draw_demografici_section(c, page_width, page_height, data):
-        draw_vertical_gradient(c, page_width, page_height, HexColor("#000000"), HexColor("#001373"), HexColor("#000000"))
-        c.setFillColor(HexColor("#FFFFFF"))
-        draw_page_header(c)
-        c.setFont("Montserrat-Regular", 26)
-        c.drawString(100, 626, "DATI DEMOGRAFICI")
-
-        target = data.get("target_demografico", {})
-
-        # 🔹 Divisione manuale in due gruppi
-        labels_page1 = ["Età", "Genere", "Professione"]
-        values_page1 = [
-            target.get("eta", ""),
-            target.get("genere", ""),
-            target.get("professione", ""),
-        ]
-
-        labels_page2 = ["Interessi", "Stile di vita"]
-        values_page2 = [
-            target.get("interessi", ""),
-            target.get("stile_vita", ""),
-        ]
-
-        # 🔹 Prima pagina (Età, Genere, Professione)
-        y_pos = page_height - 300
-        for label, value in zip(labels_page1, values_page1):
-            y_pos = check_and_new_page(c, y_pos, subtitle="DATI DEMOGRAFICI")
-
-            # Label in bold (solo titolo, senza valore accanto)
-            c.setFont("Montserrat-Bold", 29.2)
-            c.drawString(100, y_pos, f"- {label}")
-            y_pos -= 36
-
-
-            # Valore in regular sotto il label
-            c.setFont("Montserrat-Regular", 29.2)
-            text_lines = simpleSplit(value, "Montserrat-Regular", 29.2, page_width - 200)
-            for line in text_lines:
-                y_pos = check_and_new_page(c, y_pos, subtitle="DATI DEMOGRAFICI")
-                c.drawString(120, y_pos, line)
-                y_pos -= 36
-
-            y_pos -= 20
-
-        # 🔹 Seconda pagina (Interessi, Stile di vita)
-        c.showPage()
-        draw_vertical_gradient(c, page_width, page_height, HexColor("#000000"), HexColor("#001373"), HexColor("#000000"))
-        c.setFillColor(HexColor("#FFFFFF"))
-        draw_page_header(c)
-        c.setFont("Montserrat-Regular", 26)
-        c.drawString(100, 626, "DATI DEMOGRAFICI")
-
-        y_pos = page_height - 300
-        for label, value in zip(labels_page2, values_page2):
-            y_pos = check_and_new_page(c, y_pos, subtitle="DATI DEMOGRAFICI")
-
-            # Label in bold (solo titolo, senza valore accanto)
-            c.setFont("Montserrat-Bold", 29.2)
-            c.drawString(100, y_pos, f"- {label}")
-            y_pos -= 36
-
-
-            # Valore in regular sotto il label
-            c.setFont("Montserrat-Regular", 29.2)
-            text_lines = simpleSplit(value, "Montserrat-Regular", 29.2, page_width - 200)
-            for line in text_lines:
-                y_pos = check_and_new_page(c, y_pos, subtitle="DATI DEMOGRAFICI")
-                c.drawString(120, y_pos, line)
-                y_pos -= 36
-
-
-            y_pos -= 20
-
-
-    def draw_obiezioni_section(c, page_width, page_height, data):
-        obiezioni_data = data.get("obiezioni", {})
-
-        obiezioni_labels = [
-            "Necessità di risolvere il problema",
-            "Possibilità di trovare una soluzione",
-            "Tipo di soluzione proposta",
-            "Possibilità di raggiungere i risultati",
-            "Credibilità azienda"
-        ]
-
-        obiezioni_values = [
-            obiezioni_data.get("necessita", ""),
-            obiezioni_data.get("possibilita", ""),
-            obiezioni_data.get("tipo_soluzione", ""),
-            obiezioni_data.get("risultati", ""),
-            obiezioni_data.get("credibilita_azienda", "")
-        ]
-
-        for idx, (label, value) in enumerate(zip(obiezioni_labels, obiezioni_values)):
-            if idx > 0:  # Solo dalla seconda obiezione in poi
-                c.showPage()
-            draw_vertical_gradient(c, page_width, page_height, HexColor("#000000"), HexColor("#001373"), HexColor("#000000"))
-            c.setFillColor(HexColor("#FFFFFF"))
-            draw_page_header(c)
-            c.setFont("Montserrat-Regular", 26)
-            c.drawString(100, 626, "OBIEZIONI")
-            c.setFont("Montserrat-Bold", 29.2)
-
-
-
-            y_pos = page_height - 300
-
-            c.drawString(100, y_pos, f"- {label}")
-            y_pos -= 36
-
-            if value:
-                c.setFont("Montserrat-Regular", 29.2)
-                sub_values = value.split("|")
-                for sub in sub_values:
-                    sub = sub.strip()
-                    if not sub:
-                        continue
-                    text_lines = simpleSplit(sub, "Montserrat-Regular", 29.2, page_width - 200)
-                    for line in text_lines:
-                        y_pos = check_and_new_page(c, y_pos, subtitle="OBIEZIONI")
-                        c.drawString(120, y_pos, line)
-                        y_pos -= 36
-
-            y_pos -= 30
-
-    def draw_domande_section(c, page_width, page_height, data):
-        draw_vertical_gradient(c, page_width, page_height, HexColor("#000000"), HexColor("#001373"), HexColor("#000000"))
-        c.setFillColor(HexColor("#FFFFFF"))
-        draw_page_header(c)
-        c.setFont("Montserrat-Regular", 26)
-        c.drawString(100, 626, "DOMANDE TECNICHE")
-
-        domande_raw = data.get("domande_tecniche", "")
-        domande_list = domande_raw.split("|") if domande_raw else []
-
-        y_pos = page_height - 300
-        count = 0
-        max_per_page = 3
-
-        for domanda in domande_list:
-            domanda = domanda.strip()
-            if not domanda:
-                continue
-
-            # Se raggiungo 3 domande, vado a nuova pagina
-            if count >= max_per_page:
-                c.showPage()
-                draw_vertical_gradient(c, page_width, page_height, HexColor("#000000"), HexColor("#001373"), HexColor("#000000"))
-                c.setFillColor(HexColor("#FFFFFF"))
-                draw_page_header(c)
-                c.setFont("Montserrat-Regular", 26)
-                c.drawString(100, 626, "DOMANDE TECNICHE")
-                y_pos = page_height - 300
-                count = 0
-
-            y_pos = check_and_new_page(c, y_pos, subtitle="DOMANDE TECNICHE")
-
-            # Disegna la domanda in regular
-            c.setFont("Montserrat-Regular", 29.2)
-            text_lines = simpleSplit(f"- {domanda}", "Montserrat-Regular", 29.2, page_width - 200)
-            for line in text_lines:
-                y_pos = check_and_new_page(c, y_pos, subtitle="DOMANDE TECNICHE")
-                c.drawString(100, y_pos, line)
-                y_pos -= 36
-
-            count += 1
-
-
-    def draw_competitor_section(c, page_width, page_height, data):
-        draw_vertical_gradient(c, page_width, page_height, HexColor("#000000"), HexColor("#001373"), HexColor("#000000"))
-        c.setFillColor(HexColor("#FFFFFF"))
-        draw_page_header(c)
-        c.setFont("Montserrat-Regular", 26)
-        c.drawString(100, 626, "POSSIBILI DIFFICOLTÀ")
-
-        sito_web = data.get("sito_web", "il nostro Brand")
-
-        y_pos = page_height - 300
-
-        # Titolo sezione Competitor diretti
-        c.setFont("Montserrat-Bold", 29.2)
-        c.drawString(100, y_pos, "Competitor diretti:")
-        y_pos -= 36
-
-        c.setFont("Montserrat-Regular", 29.2)
-        text_lines = simpleSplit(
-            f"Questi brand vendono articoli simili a quelli offerti da {sito_web} e operano nel nostro stesso mercato.",
-            "Montserrat-Regular", 29.2, page_width - 200
-        )
-        for line in text_lines:
-            y_pos = check_and_new_page(c, y_pos, subtitle="POSSIBILI DIFFICOLTÀ")
-            c.drawString(120, y_pos, line)
-            y_pos -= 36
-
-        # Titolo sezione Competitor indiretti
-        y_pos -= 60
-        c.setFont("Montserrat-Bold", 29.2)
-        c.drawString(100, y_pos, "Competitor indiretti:")
-        y_pos -= 36
-
-        c.setFont("Montserrat-Regular", 29.2)
-        text_lines = simpleSplit(
-            f"Questi sono brand che soddisfano bisogni simili a quelli di {sito_web}, ma operano in mercati differenti.",
-            "Montserrat-Regular", 29.2, page_width - 200
-        )
-        for line in text_lines:
-            y_pos = check_and_new_page(c, y_pos, subtitle="POSSIBILI DIFFICOLTÀ")
-            c.drawString(120, y_pos, line)
-            y_pos -= 36
+    yield
 
-    def draw_bisogni_derivati_section(c, page_width, page_height, data):
-        bisogni_derivati_raw = data.get("bisogni_derivati", "")
-        bisogni_derivati_list = bisogni_derivati_raw.split("|") if bisogni_derivati_raw else []
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await job_manager.stop()
+    engine.shutdown()
 
-        spieg_bisogni_derivati_raw = data.get("spiegazione_bisogni_derivati", "")
-        spieg_bisogni_derivati_list = spieg_bisogni_derivati_raw.split("|") if spieg_bisogni_derivati_raw else []
 
-        y_pos = page_height - 300
-        count = 0
-        max_per_page = 2
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.RequestTimer)
 
-        for idx, bisogno in enumerate(bisogni_derivati_list):
-            bisogno = bisogno.strip()
-            spiegazione = spieg_bisogni_derivati_list[idx].strip() if idx < len(spieg_bisogni_derivati_list) else ""
 
-            if count >= max_per_page:
-                c.showPage()
-                draw_vertical_gradient(c, page_width, page_height, HexColor("#000000"), HexColor("#001373"), HexColor("#000000"))
-                c.setFillColor(HexColor("#FFFFFF"))
-                draw_page_header(c)
+@app.exception_handler(RequestValidationError)
+async def validation_error(request, exc):
+    """422 come quello di FastAPI, ma senza ripetere i valori oltre i limiti (vedi schema.TOO_LARGE)."""
+    errors = [
+        {key: value for key, value in error.items() if key != "input"} if error["type"] == schema.TOO_LARGE else error
+        for error in exc.errors()
+    ]
+    return JSONResponse(status_code=422, content={"detail": jsonable_encoder(errors)})
 
-                # Reimposta sempre i font dopo showPage()
-                c.setFont("Montserrat-Regular", 26)
-                c.drawString(100, 626, "BISOGNI DERIVATI")
-                c.setFont("Montserrat-Bold", 29.2)
-
-                y_pos = page_height - 300
-                count = 0
 
+# Definiamo il modello di input
+class PdfRequest(BaseModel):
+    # Validato e normalizzato all'arrivo (vedi schema.py): usare data.as_dict()
+    data: schema.ReportData
+    # Id del template (vedi report.TEMPLATES); None = template predefinito
+    template: Optional[str] = None
 
-            c.setFont("Montserrat-Bold", 29.2)
-            c.drawString(100, y_pos, f"- {bisogno}")
-            y_pos -= 36
+@app.get("/")
+def home():
+    return {"message": "PDF Service is running with ReportLab 🚀"}
 
-            if spiegazione:
-                c.setFont("Montserrat-Regular", 29.2)
-                text_lines = simpleSplit(spiegazione, "Montserrat-Regular", 29.2, page_width - 200)
-                for line in text_lines:
-                    y_pos = check_and_new_page(c, y_pos, subtitle="BISOGNI DERIVATI")
-                    c.drawString(120, y_pos, line)
-                    y_pos -= 36
 
-            y_pos -= 30
-            count += 1
+@app.get("/ready")
+def ready():
+    """Readiness: 200 solo a warm-up completato, altrimenti 503 (la liveness resta "/")."""
+    if readiness["stato"] != "pronto":
+        return JSONResponse(readiness, status_code=503)
+    return readiness
 
 
-    def draw_section_page(c, section_title, items, explanations):
-        """
-        Crea una nuova pagina con header fisso, titolo di sezione e lista punti.
-        """
-        # Nuova pagina con gradiente e header
-        c.showPage()
-        draw_vertical_gradient(c, page_width, page_height, top, mid, bottom)
-        c.setFillColor(white)
-        draw_page_header(c)
+def server_timing(timings):
+    """Tempi per sezione/fase nel formato dell'header Server-Timing (ms)."""
+    return ", ".join(f"{name};dur={sec * 1000:.1f}" for name, sec in timings.items())
 
-        # Titolo sezione
-        c.setFont("Montserrat-Bold", 29.2)
-        c.drawString(100, 472, section_title)
 
-        # Punto di partenza sotto il titolo
-        y_pos = page_height - 300
+def etag_matches(if_none_match, etag):
+    """Confronto debole tra l'header If-None-Match e un ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
 
-        # Ciclo sugli elementi
-        for idx, item in enumerate(items):
-            item = item.strip()
-            explanation = explanations[idx].strip() if idx < len(explanations) else ""
 
-            # Disegna "- item" in bold
-            c.setFont("Montserrat-Bold", 29.2)
-            text_item = f"- {item}"
-            c.drawString(100, y_pos, text_item)
-            y_pos -= 36
+def parse_pages(spec, limit, too_many="Troppe pagine selezionate"):
+    """
+    Pagine da una selezione come "1-3,7" (numeri da 1), ordinate e senza
+    duplicati. Oltre limit pagine (contate per intervallo, prima di
+    espanderlo) è un 422 con il messaggio too_many.
+    """
+    ranges = []
+    total = 0
+    try:
+        for part in spec.split(","):
+            start, _, end = part.strip().partition("-")
+            start = int(start)
+            end = int(end) if end else start
+            if start < 1 or end < start:
+                raise ValueError
+            total += end - start + 1
+            if total > limit:
+                raise HTTPException(status_code=422, detail=f"{too_many} (max {limit})")
+            ranges.append((start, end))
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Selezione di pagine non valida: {spec!r} (es. 1-3,7)")
+    pages = set()
+    for start, end in ranges:
+        pages.update(range(start, end + 1))
+    return sorted(pages)
+
+
+def pdf_filename(data):
+    sito_web = data.get("sito_web", "cliente")
+    sito_web_safe = re.sub(r'[^a-zA-Z0-9_-]', '_', sito_web)
+    return f"analisi_{sito_web_safe}.pdf"
+
+
+def pdf_headers(data, etag):
+    return {
+        "Content-Disposition": f"inline; filename={pdf_filename(data)}",
+        "ETag": etag,
+    }
+
+
+def http_error(e):
+    """Converte un errore di rendering nella HTTPException corrispondente."""
+    if isinstance(e, EngineBusy):
+        logger.warning(str(e))
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    if isinstance(e, EngineTimeout):
+        logger.error(str(e))
+        return HTTPException(status_code=504, detail=str(e))
+    if isinstance(e, ReportTooLarge):
+        logger.warning(str(e))
+        return HTTPException(status_code=413, detail=str(e))
+    if isinstance(e, (report.UnknownTemplate, report.InvalidSelection)):
+        logger.warning(str(e))
+        return HTTPException(status_code=422, detail=str(e))
+    if isinstance(e, preview.PreviewUnavailable):
+        logger.error(str(e))
+        return HTTPException(status_code=501, detail=str(e))
+    if isinstance(e, report.ReportError):
+        logger.error(str(e))
+        return HTTPException(status_code=500, detail=str(e))
+    logger.error(f"Errore generazione PDF: {str(e)}", exc_info=True)
+    return HTTPException(status_code=500, detail=f"Errore PDF: {str(e)}")
+
+
+def optimize_mode(value):
+    """Modalità di ottimizzazione richiesta (default: PDF_OPTIMIZE)."""
+    mode = (value or optimize.DEFAULT_MODE).lower()
+    if mode not in optimize.MODES:
+        raise HTTPException(status_code=422, detail=f"optimize deve essere uno tra: {', '.join(optimize.MODES)}")
+    return mode
+
+
+def report_key(data, mode="fast", template=None, selection=None):
+    """Stessi dati + stesse versioni di template/font (+ modalità e selezione) = stesso PDF."""
+    versions = [report.render_version(template)]
+    if mode != "fast":
+        versions.append(mode)
+    if selection:
+        versions.append(json.dumps(selection, sort_keys=True))
+    return result_cache.key(data, *versions)
+
+
+def parse_selection(sections, pages):
+    """Selezione di sezioni ("domande,obiezioni") e/o pagine ("1-3,60"); None = report completo."""
+    if sections is None and pages is None:
+        return None
+    selection = {}
+    if sections is not None:
+        names = [name.strip() for name in sections.split(",") if name.strip()]
+        if not names:
+            raise HTTPException(status_code=422, detail="sections non può essere vuoto")
+        selection["sezioni"] = sorted(set(names))
+    if pages is not None:
+        selection["pagine"] = parse_pages(pages, MAX_SELECTED_PAGES)
+    return selection
+
+
+async def render_cached(cache_key, data, progress=None, mode="fast", template=None, selection=None):
+    """
+    Restituisce (PdfOutput, hit): dalla cache se presente, altrimenti
+    renderizzato dal motore (nella modalità mode, con il template indicato,
+    eventualmente solo le pagine della selezione) e poi memorizzato.
+    """
+    def cached_output():
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return PdfOutput(data=cached, size=len(cached), digest=content_digest(cached))
+
+    cached = await run_in_threadpool(cached_output)
+    if result_cache.enabled:
+        metrics.CACHE_REQUESTS.inc(cache="risultati", esito="miss" if cached is None else "hit")
+    if cached is not None:
+        logger.info(f"PDF servito dalla cache ({cached.size} byte)")
+        metrics.REPORTS.inc(origine="cache")
+        metrics.OUTPUT_BYTES.inc(cached.size)
+        return cached, True
+
+    # Il rendering gira nel pool di processi: l'event loop resta libero
+    pdf = await engine.render_report(data, progress, mode, template, selection)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Tempi di rendering: " + ", ".join(f"{name} {sec * 1000:.1f} ms" for name, sec in pdf.timings.items()))
+    metrics.observe_timings(pdf.timings, report.SECTIONS)
+    metrics.REPORTS.inc(origine="render")
+    metrics.OUTPUT_BYTES.inc(pdf.size)
+    if pdf.pages:
+        metrics.PAGES.inc(pdf.pages)
+
+    # Letto in RAM solo se la cache lo può davvero conservare
+    if result_cache.enabled and pdf.size <= result_cache.memory.max_entry_bytes:
+        await run_in_threadpool(lambda: result_cache.put(cache_key, pdf.read_bytes()))
+    return pdf, False
+
+
+async def render_bytes(data, progress=None, template=None):
+    """
+    Genera il report e ne restituisce i byte. Usata da batch e job, che non
+    devono fallire se il motore è momentaneamente saturo: in quel caso
+    riprova dopo Retry-After.
+    """
+    mode = optimize_mode(None)
+    cache_key = report_key(data, mode, template)
+    for attempt in range(BATCH_BUSY_RETRIES + 1):
+        try:
+            pdf, _ = await render_cached(cache_key, data, progress, mode, template)
+            break
+        except EngineBusy as e:
+            if attempt == BATCH_BUSY_RETRIES:
+                raise
+            await asyncio.sleep(e.retry_after)
 
-            if explanation:
-                c.setFont("Montserrat-Regular", 29.2)
-                text_lines = simpleSplit(explanation, "Montserrat-Regular", 29.2, page_width - 200)
-                for line in text_lines:
-                    y_pos = check_and_new_page(c, y_pos)
-                    c.drawString(120, y_pos, line)
-                    y_pos -= 36
+    try:
+        return await run_in_threadpool(pdf.read_bytes)
+    finally:
+        pdf.cleanup()
 
-            y_pos -= 20
 
+# Job asincroni: al massimo engine.workers report alla volta, gli altri in coda
+job_manager = jobs.JobManager(render_bytes, report.SECTIONS, concurrency=engine.workers)
 
-        return y_pos
+# Valori letti a ogni esportazione di /metrics
+metrics.ENGINE_PENDING.set_function(lambda: engine.pending)
+metrics.ENGINE_CAPACITY.set_function(lambda: engine.workers + engine.max_queue)
+metrics.ENGINE_MEMORY_RESERVED.set_function(lambda: engine.memory.reserved)
+metrics.ENGINE_MEMORY_BUDGET.set_function(lambda: engine.memory.limit)
+metrics.JOBS_ACTIVE.set_function(lambda: job_manager.store.count_active())
 
 
+def timed_chunks(pdf):
+    """Blocchi del PDF da inviare, misurando la durata dell'invio."""
+    t0 = time.perf_counter()
+    try:
+        yield from pdf.iter_chunks()
+    finally:
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - t0, fase="invio")
 
-    benefici_buffer = render_section_to_buffer(
-    "BENEFICI PER IL CLIENTE",
-    lambda c, w, h: draw_benefici_section(c, w, h, body.data)
-)
 
+@app.get("/metrics")
+def read_metrics():
+    """Metriche del processo in formato Prometheus."""
+    return Response(metrics.registry.render(), media_type=metrics.registry.content_type)
 
-    bisogni_buffer = render_section_to_buffer(
-        "BISOGNI PRIMARI (SECONDO LA TEORIA DI ROBBINS)",
-        lambda c, w, h: draw_bisogni_section(c, w, h, body.data)
-)
 
-    demografici_buffer = render_section_to_buffer(
-        "DATI DEMOGRAFICI",
-        lambda c, w, h: draw_demografici_section(c, w, h, body.data)
+@app.post("/generate-pdf")
+async def generate_pdf(body: PdfRequest, request: Request, optimize_query: str = Query(None, alias="optimize"),
+                       sections: str = None, pages: str = None):
+    """
+    Genera il report. ?optimize=size produce un file più piccolo (stream
+    ricompressi, oggetti duplicati fusi) a costo di un render più lento;
+    ?optimize=fast (default, vedi PDF_OPTIMIZE) scrive il PDF così com'è.
+    ?sections=domande,obiezioni e/o ?pages=1-3,60 generano solo quelle
+    sezioni/pagine del report completo (vengono disegnate solo le sezioni
+    necessarie); i lettori PDF mostrano i numeri di pagina del report completo.
+    L'output è deterministico: l'ETag è l'hash SHA-256 del PDF, uguale per
+    richieste uguali anche tra processi, riavvii e istanze diverse.
+    """
+    # Lettura e validazione del corpo, fatte da FastAPI prima di arrivare qui
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - request.state.ricevuta, fase="lettura_richiesta")
+    # Payload campionato e troncato: riassunto calcolato solo se il record viene emesso
+    data = body.data.as_dict()
+    payload_logger.info("Dati ricevuti per la generazione del PDF", extra={"payload": logs.PayloadSummary(data)})
+
+    mode = optimize_mode(optimize_query)
+    selection = parse_selection(sections, pages)
+    try:
+        cache_key = report_key(data, mode, body.template, selection)
+        pdf, hit = await render_cached(cache_key, data, mode=mode, template=body.template, selection=selection)
+    except Exception as e:
+        raise http_error(e)
+
+    # Il client ha già questo PDF: di solito servito dalla cache, quindi senza render
+    etag = f'"{pdf.digest}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        pdf.cleanup()
+        return Response(status_code=304, headers={"ETag": etag})
+
+    headers = {
+        **pdf_headers(data, etag),
+        "Content-Length": str(pdf.size),
+        "X-Cache": "HIT" if hit else "MISS",
+    }
+    if pdf.timings:
+        headers["Server-Timing"] = server_timing(pdf.timings)
+
+    # Il PDF viene inviato a blocchi (da RAM o dal file temporaneo del worker);
+    # il file temporaneo viene rimosso anche se il client si disconnette prima
+    return StreamingResponse(
+        timed_chunks(pdf), media_type="application/pdf", headers=headers, background=BackgroundTask(pdf.cleanup)
     )
 
-    obiezioni_buffer = render_section_to_buffer(
-        "OBIEZIONI",
-        lambda c, w, h: draw_obiezioni_section(c, w, h, body.data)
-    )
 
-    domande_buffer = render_section_to_buffer(
-        "DOMANDE TECNICHE",
-        lambda c, w, h: draw_domande_section(c, w, h, body.data)
-    )
+@app.post("/preview")
+async def preview_pages(body: PdfRequest, request: Request, pages: str = "1", dpi: int = 72, format: str = "png"):
+    """
+    Anteprima di alcune pagine del report come immagini, senza generare il
+    PDF completo: pages è una selezione come "1-3,7" (numeri del report
+    completo), dpi la risoluzione, format "png" o "webp". Una sola pagina
+    arriva come immagine, più pagine come archivio ZIP.
+    """
+    data = body.data.as_dict()
+    numbers = parse_pages(pages, preview.MAX_PAGES, "Troppe pagine per l'anteprima")
+    if not preview.MIN_DPI <= dpi <= preview.MAX_DPI:
+        raise HTTPException(status_code=422, detail=f"dpi deve essere tra {preview.MIN_DPI} e {preview.MAX_DPI}")
+    if format not in preview.FORMATS:
+        raise HTTPException(status_code=422, detail=f"format deve essere uno tra: {', '.join(preview.FORMATS)}")
 
-    competitor_buffer = render_section_to_buffer(
-        "POSSIBILI DIFFICOLTÀ",
-        lambda c, w, h: draw_competitor_section(c, w, h, body.data)
-    )
+    try:
+        etag = f'"{result_cache.key(data, report.render_version(body.template), "anteprima", numbers, dpi, format)}"'
+    except report.ReportError as e:
+        raise http_error(e)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
 
-    derivati_buffer = render_section_to_buffer(
-        "BISOGNI DERIVATI",
-        lambda c, w, h: draw_bisogni_derivati_section(c, w, h, body.data)
+    try:
+        # Le pagine custom richiedono di disegnare le loro sezioni intere
+        cost = report.estimate_cost(data, body.template, {"pagine": numbers})
+        images, stats = await engine.run(
+            preview.render_preview, data, numbers, dpi, format, body.template, memory=cost.byte
+        )
+    except Exception as e:
+        raise http_error(e)
+    logger.info(f"Anteprima di {len(images)} pagine: {stats['template_cache']} dalla cache, {stats['rasterizzate']} rasterizzate")
+
+    media_type = preview.FORMATS[format][1]
+    if len(images) == 1:
+        return Response(images[0][1], media_type=media_type, headers={"ETag": etag})
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, mode="w", compression=zipfile.ZIP_STORED) as zf:
+        for number, image in images:
+            zf.writestr(f"pagina_{number:03d}.{format}", image)
+    return Response(
+        archive.getvalue(),
+        media_type="application/zip",
+        headers={"ETag": etag, "Content-Disposition": "attachment; filename=anteprima.zip"},
     )
 
 
+@app.post("/generate-pdf/batch")
+async def generate_pdf_batch(request: Request):
+    """
+    Genera più report in una sola richiesta e restituisce un archivio ZIP in
+    streaming, con i PDF aggiunti man mano che vengono completati.
+    Il corpo può essere un array JSON di PdfRequest oppure un flusso NDJSON
+    (Content-Type: application/x-ndjson), un PdfRequest per riga.
+    Gli errori dei singoli elementi sono riportati in manifest.json.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type:
+        # Il corpo va letto prima di rispondere: durante lo streaming della
+        # risposta il canale di ricezione serve a rilevare la disconnessione
+        payload = []
+        async for _, item in batch.iter_ndjson(request.stream()):
+            payload.append(item)
+            if len(payload) > BATCH_MAX_ITEMS:
+                raise HTTPException(status_code=413, detail=f"Troppi elementi nel batch (max {BATCH_MAX_ITEMS})")
+    else:
+        try:
+            payload = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Corpo della richiesta non valido: atteso un array JSON")
+        if not isinstance(payload, list):
+            raise HTTPException(status_code=400, detail="Corpo della richiesta non valido: atteso un array JSON")
+        if len(payload) > BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"Troppi elementi nel batch (max {BATCH_MAX_ITEMS})")
+    items = batch.iter_list(payload)
+
+    async def render_item(payload):
+        body = PdfRequest.model_validate(payload)
+        data = body.data.as_dict()
+        return pdf_filename(data), await render_bytes(data, template=body.template)
+
+    logger.info(f"Batch avviato: {len(payload)} elementi")
+    return StreamingResponse(
+        batch.stream_zip(items, render_item, concurrency=engine.workers),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=analisi_batch.zip"},
+    )
 
 
- 
-
-    # Chiudi e copia il PDF intero in un buffer principale
-    c.save()
-    buffer.seek(0)
-
-    # Carica PDF intero e splitta manualmente i blocchi
-    custom_reader = PdfReader(buffer)
+def job_status(job):
+    return {
+        "id": job["id"],
+        "stato": job["stato"],
+        "sezioni": job["sezioni"],
+        "completate": sum(job["sezioni"].values()),
+        "totale": len(job["sezioni"]),
+        "byte": job["byte"],
+        "errore": job["errore"],
+        "creato": job["creato"],
+        "aggiornato": job["aggiornato"],
+    }
 
-    # Assegna i blocchi a buffer separati
 
+@app.post("/jobs", status_code=202)
+async def create_job(body: PdfRequest):
+    """
+    Accoda la generazione di un report e restituisce subito l'id del job:
+    stato e avanzamento su GET /jobs/{id}, PDF su GET /jobs/{id}/result.
+    """
     try:
-        # === NUOVO BLOCCO: Unisci il template standard con le pagine custom ===
-
-        # Percorso del template (relativo alla posizione di main.py)
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        template_path = os.path.join(base_dir, "templates", "template_analisi.pdf")
+        data = body.data.as_dict()
+        # Template sconosciuto o mancante: errore subito, non dentro il job
+        report.render_version(body.template)
+        sections = report.get_template(body.template).sections
+        job = await job_manager.submit(data, pdf_filename(data), sections, template=body.template)
+    except report.ReportError as e:
+        raise http_error(e)
+    except jobs.JobStoreFull as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(engine.retry_after)})
+
+    logger.info(f"Job {job['id']} accodato")
+    return JSONResponse(
+        job_status(job),
+        status_code=202,
+        headers={"Location": f"/jobs/{job['id']}"},
+    )
 
-        # Log per verificare se il file esiste
-        logger.info(f"Percorso template: {template_path}")
-        logger.info(f"File esiste? {os.path.exists(template_path)}")
 
-        # Stampa il contenuto della cartella templates
-        try:
-            logger.info(f"Contenuto cartella templates: {os.listdir(os.path.join(base_dir, 'templates'))}")
-        except Exception as e:
-            logger.warning(f"Impossibile leggere cartella templates: {str(e)}")
+def get_job(job_id):
+    job = job_manager.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job non trovato o scaduto")
+    return job
 
-        if not os.path.exists(template_path):
-            raise HTTPException(status_code=500, detail=f"Template PDF non trovato: {template_path}")
 
-        logger.info(f"Sto per aprire il template: {template_path}")
+@app.get("/jobs/{job_id}")
+async def read_job(job_id: str):
+    job = await run_in_threadpool(get_job, job_id)
+    return job_status(job)
 
-        try:
-            template_reader = PdfReader(template_path)
-            logger.info(f"Template caricato con {len(template_reader.pages)} pagine")
-        except Exception as e:
-            logger.error(f"Errore durante l'apertura del template: {str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Errore lettura template: {str(e)}")
-
-        # Carica i blocchi custom
-        benefici_reader = PdfReader(benefici_buffer)
-        bisogni_reader = PdfReader(bisogni_buffer)
-        demo_reader = PdfReader(demografici_buffer)
-        obiezioni_reader = PdfReader(obiezioni_buffer)
-        domande_reader = PdfReader(domande_buffer)
-        competitor_reader = PdfReader(competitor_buffer)
-        derivati_reader = PdfReader(derivati_buffer)
-
-        logger.info(f"Benefici_buffer: {len(benefici_reader.pages)} pagine")
-        logger.info(f"Bisogni_buffer: {len(bisogni_reader.pages)} pagine")
-        logger.info(f"Demografici_buffer: {len(demo_reader.pages)} pagine")
-        logger.info(f"Obiezioni_buffer: {len(obiezioni_reader.pages)} pagine")
-        logger.info(f"Domande_buffer: {len(domande_reader.pages)} pagine")
-        logger.info(f"Competitor_buffer: {len(competitor_reader.pages)} pagine")
-        logger.info(f"Derivati_buffer: {len(derivati_reader.pages)} pagine")
-
-        # Writer per il PDF finale
-        final_writer = PdfWriter()
-        logger.info(f"Template ha {len(template_reader.pages)} pagine totali")
-
-        # --- Inserisci prime 3 pagine standard (se esistono) ---
-        for i in range(min(3, len(template_reader.pages))):
-            final_writer.add_page(template_reader.pages[i])
-
-        # --- Inserisci blocchi custom ---
-        for page in benefici_reader.pages: final_writer.add_page(page)
-        for page in bisogni_reader.pages: final_writer.add_page(page)
-        for page in demo_reader.pages: final_writer.add_page(page)
-
-        # --- Inserisci pagina 4 standard (se esiste) ---
-        if len(template_reader.pages) > 3:
-            final_writer.add_page(template_reader.pages[3])
-
-        # --- Inserisci altri blocchi custom ---
-        for page in obiezioni_reader.pages: final_writer.add_page(page)
-        for page in domande_reader.pages: final_writer.add_page(page)
-        for page in competitor_reader.pages: final_writer.add_page(page)
-
-        # --- Inserisci pagine standard da 5 a 59 (se esistono) ---
-        for i in range(4, min(59, len(template_reader.pages))):
-            final_writer.add_page(template_reader.pages[i])
-
-        # --- Inserisci bisogni derivati ---
-        for page in derivati_reader.pages: final_writer.add_page(page)
-
-        # --- Inserisci eventuali pagine restanti ---
-        for i in range(59, len(template_reader.pages)):
-            final_writer.add_page(template_reader.pages[i])
-
-        # Salva il risultato in un nuovo buffer
-        final_buffer = io.BytesIO()
-        final_writer.write(final_buffer)
-        final_buffer.seek(0)
-        
-        import re
-
-        sito_web = body.data.get("sito_web", "cliente")
-        sito_web_safe = re.sub(r'[^a-zA-Z0-9_-]', '_', sito_web)
-
-
-        return StreamingResponse(final_buffer, media_type="application/pdf", headers={
-    "Content-Disposition": f"inline; filename=analisi_{sito_web_safe}.pdf"
-})
 
+@app.get("/jobs/{job_id}/result")
+async def read_job_result(job_id: str):
+    job = await run_in_threadpool(get_job, job_id)
+    if job["stato"] == jobs.ERRORE:
+        raise HTTPException(status_code=500, detail=f"Errore PDF: {job['errore']}")
+    if job["stato"] != jobs.COMPLETATO:
+        raise HTTPException(status_code=409, detail=f"Job non ancora completato (stato: {job['stato']})")
 
-    except Exception as e:
-        logger.error(f"Errore generazione PDF: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Errore PDF: {str(e)}")
+    pdf_bytes = await run_in_threadpool(job_manager.store.get_result, job_id)
+    if pdf_bytes is None:
+        raise HTTPException(status_code=404, detail="Risultato del job non trovato o scaduto")
+    return Response(
+        content=pdf_bytes,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f"inline; filename={job['file']}"},
+    )
@@ -0,0 +1,230 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+# Limiti superiori (secondi) degli istogrammi dei tempi: da 1 ms a 2 minuti
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+@contextmanager
+def span(timings, stage):
+    """
+    Misura la durata del blocco e la somma in timings[stage] (secondi).
+    Usato anche nei worker: i tempi tornano al processo principale dentro
+    PdfOutput.timings e diventano metriche lì (vedi observe_timings).
+    """
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - t0
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Etichette non valide per {self.name}: {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Contatore monotono (il nome esposto termina con _total)."""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = self.header()
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Valore istantaneo: impostato con set() oppure letto a ogni esportazione
+    da una funzione (set_function), es. la coda del motore.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def collect(self):
+        lines = self.header()
+        if self._function is not None:
+            lines.append(f"{self.name} {_format_value(self._function())}")
+            return lines
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Istogramma a bucket fissi, nel formato cumulativo di Prometheus."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            state["counts"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def collect(self):
+        with self._lock:
+            values = {key: (list(state["counts"]), state["sum"], state["count"]) for key, state in self._values.items()}
+        lines = self.header()
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Metriche del processo, esportate in formato testo Prometheus (0.0.4)."""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# === Metriche del servizio PDF ===
+STAGE_SECONDS = registry.register(Histogram(
+    "pdf_stage_seconds", "Durata delle fasi di generazione del PDF", ["fase"]))
+SECTION_SECONDS = registry.register(Histogram(
+    "pdf_section_seconds", "Durata del render di ogni sezione custom", ["sezione"]))
+REQUEST_SECONDS = registry.register(Histogram(
+    "pdf_request_seconds", "Durata delle richieste HTTP fino all'ultimo byte della risposta", ["endpoint", "stato"]))
+PAGES = registry.register(Counter(
+    "pdf_pages_total", "Pagine dei PDF prodotti"))
+OUTPUT_BYTES = registry.register(Counter(
+    "pdf_output_bytes_total", "Byte dei PDF consegnati (renderizzati o dalla cache)"))
+REPORTS = registry.register(Counter(
+    "pdf_reports_total", "Report consegnati, per origine (render o cache)", ["origine"]))
+CACHE_REQUESTS = registry.register(Counter(
+    "pdf_cache_requests_total", "Letture delle cache per esito", ["cache", "esito"]))
+ENGINE_PENDING = registry.register(Gauge(
+    "pdf_engine_pending_jobs", "Job del motore di rendering in esecuzione o in coda"))
+ENGINE_CAPACITY = registry.register(Gauge(
+    "pdf_engine_capacity_jobs", "Job accettati al massimo dal motore (worker + coda)"))
+ENGINE_MEMORY_RESERVED = registry.register(Gauge(
+    "pdf_engine_memory_reserved_bytes", "Memoria stimata riservata dai job del motore in esecuzione"))
+ENGINE_MEMORY_BUDGET = registry.register(Gauge(
+    "pdf_engine_memory_budget_bytes", "Budget di memoria del motore (0 = nessun limite)"))
+JOBS_ACTIVE = registry.register(Gauge(
+    "pdf_async_jobs_active", "Job asincroni in coda o in corso"))
+
+
+def observe_timings(timings, sections):
+    """Registra i tempi di PdfOutput.timings: sezioni custom e fasi separate."""
+    for stage, seconds in timings.items():
+        if stage in sections:
+            SECTION_SECONDS.observe(seconds, sezione=stage)
+        else:
+            STAGE_SECONDS.observe(seconds, fase=stage)
+
+
+class RequestTimer:
+    """
+    Middleware ASGI: durata di ogni richiesta HTTP, risposte in streaming
+    comprese, per route e codice di stato. Salva anche l'istante di arrivo in
+    request.state.ricevuta, per misurare la lettura del corpo.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        scope.setdefault("state", {})["ricevuta"] = t0
+        status = {"code": 500}
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            route = scope.get("route")
+            endpoint = route.path if route is not None else "altro"
+            REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint=endpoint, stato=status["code"])
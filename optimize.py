@@ -0,0 +1,253 @@
+"""
+Ottimizzazione della dimensione dei PDF assemblati (modalità "size").
+
+- Compressione: gli stream senza filtro o codificati solo con ASCII85/Flate
+  (ReportLab usa ASCII85 + Flate, +25% rispetto al solo Flate) vengono
+  ricompressi con Flate al livello massimo, se il risultato è più piccolo.
+- Deduplicazione: gli oggetti identici (font, Form XObject, risorse, stream)
+  vengono fusi in uno solo, ripetendo finché qualcosa cambia: fondere due
+  font rende identici anche i dizionari di risorse che li usano.
+- Report: byte per categoria di oggetto e font incorporati, per capire cosa
+  pesa nel documento.
+
+Da riga di comando, su un PDF esistente:
+
+    python -m optimize input.pdf [output.pdf]
+"""
+import io
+import os
+import sys
+import zlib
+from collections import defaultdict
+
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject
+
+
+# Modalità di generazione accettate da /generate-pdf?optimize=: "fast"
+# scrive il PDF così com'è, "size" lo ottimizza (più lento, file più piccolo)
+MODES = ("fast", "size")
+DEFAULT_MODE = os.environ.get("PDF_OPTIMIZE", "fast").lower()
+
+# Filtri che possiamo decodificare e ricomprimere senza perdita
+_RECOMPRESSIBLE = {"/FlateDecode", "/ASCII85Decode"}
+
+# Oggetti della struttura del documento: mai fusi (ogni pagina deve restare distinta)
+_STRUCTURAL_TYPES = {"/Page", "/Pages", "/Catalog"}
+
+
+def _filters(obj):
+    value = obj.get("/Filter")
+    if value is None:
+        return []
+    if isinstance(value, ArrayObject):
+        return [str(f) for f in value]
+    return [str(value)]
+
+
+def compress_stream(obj):
+    """
+    Ricomprime uno stream con Flate al livello massimo, se possibile e se
+    conviene; restituisce i byte risparmiati.
+    """
+    if "/DecodeParms" in obj:
+        return 0
+    filters = _filters(obj)
+    if filters == ["/FlateDecode"] or not set(filters) <= _RECOMPRESSIBLE:
+        return 0
+
+    compressed = zlib.compress(obj.get_data(), 9)
+    if len(compressed) >= len(obj._data):
+        return 0
+
+    saved = len(obj._data) - len(compressed)
+    obj._data = compressed
+    obj[NameObject("/Filter")] = NameObject("/FlateDecode")
+    if hasattr(obj, "decoded_self"):
+        obj.decoded_self = None
+    return saved
+
+
+def compress_streams(writer):
+    """Ricomprime gli stream del writer; restituisce i byte risparmiati."""
+    return sum(compress_stream(obj) for obj in writer._objects if isinstance(obj, StreamObject))
+
+
+def _serialize(obj):
+    buffer = io.BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+
+def _replace_references(obj, mapping, writer):
+    """Sostituisce in obj (ricorsivamente) i riferimenti secondo mapping {idnum: idnum}."""
+    if isinstance(obj, DictionaryObject):
+        items = obj.items()
+    elif isinstance(obj, ArrayObject):
+        items = enumerate(obj)
+    else:
+        return
+
+    for key, value in list(items):
+        if isinstance(value, IndirectObject):
+            if value.idnum in mapping:
+                obj[key] = IndirectObject(mapping[value.idnum], 0, writer)
+        else:
+            _replace_references(value, mapping, writer)
+
+
+def deduplicate(writer):
+    """
+    Fonde gli oggetti identici del writer (prima di write()) e rinumera gli
+    oggetti rimasti. Restituisce il numero di oggetti eliminati.
+    """
+    objects = writer._objects
+    removed = set()
+
+    while True:
+        canonical = {}
+        mapping = {}
+        for index, obj in enumerate(objects):
+            idnum = index + 1
+            if obj is None or idnum in removed:
+                continue
+            if isinstance(obj, DictionaryObject) and obj.get("/Type") in _STRUCTURAL_TYPES:
+                continue
+            key = _serialize(obj)
+            if key in canonical:
+                mapping[idnum] = canonical[key]
+            else:
+                canonical[key] = idnum
+
+        if not mapping:
+            break
+        removed.update(mapping)
+        for index, obj in enumerate(objects):
+            if index + 1 not in removed:
+                _replace_references(obj, mapping, writer)
+
+    if removed:
+        _renumber(writer, removed)
+    return len(removed)
+
+
+def _renumber(writer, removed):
+    """Compatta writer._objects togliendo gli oggetti in removed."""
+    mapping = {}
+    kept = []
+    for index, obj in enumerate(writer._objects):
+        idnum = index + 1
+        if idnum in removed:
+            continue
+        kept.append(obj)
+        mapping[idnum] = len(kept)
+
+    for obj in kept:
+        _replace_references(obj, mapping, writer)
+        if getattr(obj, "indirect_reference", None) is not None:
+            obj.indirect_reference = IndirectObject(mapping[obj.indirect_reference.idnum], 0, writer)
+
+    writer._objects = kept
+    for attr in ("_root", "_pages", "_info"):
+        ref = getattr(writer, attr, None)
+        if ref is not None:
+            setattr(writer, attr, IndirectObject(mapping[ref.idnum], 0, writer))
+    # Le tabelle di PyPDF2 per riconoscere oggetti già copiati puntano ai vecchi numeri
+    writer._idnum_hash = {}
+    writer._id_translated = {}
+
+
+def optimize_writer(writer):
+    """Compressione + deduplicazione; restituisce un riepilogo per il log."""
+    saved = compress_streams(writer)
+    merged = deduplicate(writer)
+    return {"byte_risparmiati_compressione": saved, "oggetti_fusi": merged}
+
+
+def _category(obj, font_programs):
+    if isinstance(obj, StreamObject):
+        if id(obj) in font_programs:
+            return "programmi_font"
+        subtype = obj.get("/Subtype")
+        if subtype == "/Image":
+            return "immagini"
+        if subtype == "/Form":
+            return "form_xobject"
+        return "stream_contenuti"
+    if isinstance(obj, DictionaryObject):
+        kind = obj.get("/Type")
+        if kind in ("/Font", "/FontDescriptor"):
+            return "font"
+        if kind in ("/Page", "/Pages", "/Catalog"):
+            return "struttura"
+    return "altro"
+
+
+def size_report(writer):
+    """
+    Contributo di ogni categoria di oggetto alla dimensione del documento e
+    font incorporati (nome, byte): più programmi per lo stesso font indicano
+    sottoinsiemi duplicati (es. una copia per ogni sezione).
+    """
+    font_programs = {}
+    for obj in writer._objects:
+        if isinstance(obj, DictionaryObject) and obj.get("/Type") == "/FontDescriptor":
+            for key in ("/FontFile", "/FontFile2", "/FontFile3"):
+                if key in obj:
+                    program = obj[key].get_object()
+                    font_programs[id(program)] = str(obj.get("/FontName", "?")).split("+")[-1]
+
+    categories = defaultdict(lambda: {"oggetti": 0, "byte": 0})
+    fonts = defaultdict(lambda: {"copie": 0, "byte": 0})
+    for obj in writer._objects:
+        if obj is None:
+            continue
+        size = len(_serialize(obj))
+        category = categories[_category(obj, font_programs)]
+        category["oggetti"] += 1
+        category["byte"] += size
+        if id(obj) in font_programs:
+            font = fonts[font_programs[id(obj)]]
+            font["copie"] += 1
+            font["byte"] += size
+
+    return {
+        "categorie": dict(sorted(categories.items(), key=lambda item: -item[1]["byte"])),
+        "font": dict(fonts),
+    }
+
+
+def _print_report(title, report, size):
+    print(f"{title}: {size / 1024:.1f} KB")
+    for name, values in report["categorie"].items():
+        print(f"  {name:<18} {values['oggetti']:5d} oggetti  {values['byte'] / 1024:9.1f} KB")
+    for name, values in report["font"].items():
+        print(f"  font {name:<24} {values['copie']:3d} copie  {values['byte'] / 1024:9.1f} KB")
+
+
+def main(argv):
+    if not argv:
+        print(__doc__)
+        return 1
+
+    with open(argv[0], "rb") as f:
+        data = f.read()
+    writer = PdfWriter()
+    for page in PdfReader(io.BytesIO(data)).pages:
+        writer.add_page(page)
+
+    _print_report("Prima", size_report(writer), len(data))
+    summary = optimize_writer(writer)
+    output = io.BytesIO()
+    writer.write(output)
+    _print_report("Dopo", size_report(writer), output.tell())
+    print(f"  {summary}")
+
+    if len(argv) > 1:
+        with open(argv[1], "wb") as f:
+            f.write(output.getvalue())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,129 @@
+import os
+import io
+import hashlib
+import tempfile
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Oltre questa soglia il PDF viene scritto su file temporaneo invece che in RAM
+SPOOL_THRESHOLD = int(os.environ.get("PDF_SPOOL_THRESHOLD", 8 * 1024 * 1024))
+SPOOL_DIR = os.environ.get("PDF_SPOOL_DIR") or tempfile.gettempdir()
+CHUNK_SIZE = 64 * 1024
+
+
+def content_digest(data):
+    """Hash del contenuto di un PDF (SHA-256 esadecimale), usato come ETag."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class PdfOutput:
+    """
+    PDF generato, restituito dal worker al processo principale.
+    I documenti piccoli viaggiano come bytes, quelli grandi restano su un file
+    temporaneo (il processo principale riceve solo il percorso) e vengono
+    inviati al client a blocchi, poi cancellati.
+    """
+
+    def __init__(self, data=None, path=None, size=0, timings=None, pages=None, digest=None):
+        self.data = data
+        self.path = path
+        self.size = size
+        # SHA-256 del contenuto (vedi content_digest)
+        self.digest = digest
+        # Tempi per fase di rendering, in secondi (vedi report.write_report)
+        self.timings = timings or {}
+        # Pagine del documento (None se servito dalla cache)
+        self.pages = pages
+
+    @property
+    def spooled(self):
+        return self.path is not None
+
+    def read_bytes(self):
+        if self.data is not None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        """Restituisce il PDF a blocchi; il file temporaneo viene rimosso alla fine."""
+        if self.data is not None:
+            view = memoryview(self.data)
+            for start in range(0, self.size, chunk_size):
+                yield bytes(view[start:start + chunk_size])
+            return
+
+        try:
+            with open(self.path, "rb") as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        finally:
+            self.cleanup()
+
+    def cleanup(self):
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class OutputSpool(io.RawIOBase):
+    """
+    Stream di scrittura per PdfWriter: resta in memoria finché non supera
+    `threshold` byte, poi riversa tutto su un file temporaneo con nome
+    (così il percorso può passare da un processo all'altro). L'hash del
+    contenuto viene calcolato durante la scrittura.
+    """
+
+    def __init__(self, threshold=None, directory=None):
+        super().__init__()
+        self.threshold = SPOOL_THRESHOLD if threshold is None else threshold
+        self.directory = directory or SPOOL_DIR
+        self._buffer = io.BytesIO()
+        self._file = None
+        self._size = 0
+        self._digest = hashlib.sha256()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self._file is None and self._size + len(b) > self.threshold:
+            self._file = tempfile.NamedTemporaryFile(
+                dir=self.directory, prefix="analisi_", suffix=".pdf", delete=False
+            )
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = None
+
+        target = self._file if self._file is not None else self._buffer
+        target.write(b)
+        self._digest.update(b)
+        self._size += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._size
+
+    def discard(self):
+        """Abbandona lo spool dopo un errore: il file temporaneo, se c'è, viene rimosso."""
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.unlink(self._file.name)
+            except FileNotFoundError:
+                pass
+        self._buffer = None
+
+    def finish(self):
+        """Chiude lo spool e restituisce il PdfOutput corrispondente."""
+        if self._file is not None:
+            self._file.close()
+            logger.info(f"PDF di {self._size} byte scritto su disco: {self._file.name}")
+            return PdfOutput(path=self._file.name, size=self._size, digest=self._digest.hexdigest())
+        return PdfOutput(data=self._buffer.getvalue(), size=self._size, digest=self._digest.hexdigest())
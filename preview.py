@@ -0,0 +1,99 @@
+"""
+Anteprima del report come immagini (PNG/WebP), pagina per pagina.
+
+Gira nei worker del motore: vengono disegnate solo le sezioni che contengono
+le pagine richieste, e le pagine del template vengono rasterizzate una sola
+volta per (versione del template, pagina, DPI, formato) e poi servite dalla
+cache del worker. Richiede pypdfium2 (vedi requirements.txt).
+"""
+import io
+import os
+import logging
+
+from cache import LRUCache
+import report
+
+
+logger = logging.getLogger(__name__)
+
+# Formati supportati: nome per Pillow e Content-Type
+FORMATS = {"png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp")}
+MIN_DPI = 10
+MAX_DPI = int(os.environ.get("PDF_PREVIEW_MAX_DPI", 200))
+MAX_PAGES = int(os.environ.get("PDF_PREVIEW_MAX_PAGES", 20))
+
+# Immagini delle pagine del template, per processo worker
+template_images = LRUCache(int(os.environ.get("PDF_PREVIEW_CACHE_MAX_BYTES", 64 * 1024 * 1024)))
+
+
+class PreviewUnavailable(report.ReportError):
+    """Rasterizzazione non disponibile (pypdfium2 non installato)."""
+
+
+def _pdfium():
+    try:
+        import pypdfium2
+    except ImportError:
+        raise PreviewUnavailable("Anteprima non disponibile: installare pypdfium2")
+    return pypdfium2
+
+
+def rasterize(document, index, dpi, fmt):
+    """Pagina index (da 0) di un documento pypdfium2, come immagine codificata."""
+    page = document[index]
+    try:
+        image = page.render(scale=dpi / 72).to_pil()
+    finally:
+        page.close()
+    buffer = io.BytesIO()
+    image.save(buffer, format=FORMATS[fmt][0])
+    return buffer.getvalue()
+
+
+def render_preview(data, pages, dpi=72, fmt="png", template_id=None):
+    """
+    Immagini delle pagine richieste (numeri da 1, come nel report completo).
+    Restituisce [(pagina, bytes), ...] e le statistiche della cache.
+    """
+    pdfium = _pdfium()
+    origins, pages = report.select_pages(data, {"pagine": pages}, template_id)
+
+    template = report.load_template(template_id)
+    images = {}
+    missing_template = []
+    for number in pages:
+        origin = origins[number - 1]
+        if origin[0] == "template":
+            cached = template_images.get((template.version, origin[1], dpi, fmt))
+            if cached is not None:
+                images[number] = cached
+            else:
+                missing_template.append(number)
+
+    if missing_template:
+        document = pdfium.PdfDocument(template.path)
+        try:
+            for number in missing_template:
+                index = origins[number - 1][1]
+                images[number] = rasterize(document, index, dpi, fmt)
+                template_images.put((template.version, index, dpi, fmt), images[number])
+        finally:
+            document.close()
+
+    # Pagine custom: solo le sezioni che le contengono, su un unico canvas
+    custom = [number for number in pages if origins[number - 1][0] == "sezione"]
+    if custom:
+        names = [name for name in report.get_template(template_id).sections
+                 if any(origins[number - 1][1] == name for number in custom)]
+        buffer, ranges, _ = report.render_sections(data, names)
+        document = pdfium.PdfDocument(buffer.getvalue())
+        try:
+            for number in custom:
+                _, name, index = origins[number - 1]
+                images[number] = rasterize(document, ranges[name][0] + index, dpi, fmt)
+        finally:
+            document.close()
+
+    rasterized = len(missing_template) + len(custom)
+    stats = {"template_cache": len(pages) - rasterized, "rasterizzate": rasterized}
+    return [(number, images[number]) for number in pages], stats
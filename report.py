@@ -0,0 +1,620 @@
+import os
+import io
+import time
+import logging
+import tempfile
+from collections import namedtuple
+from reportlab.pdfgen import canvas
+from reportlab.lib.colors import HexColor, Color
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from PyPDF2 import PdfReader
+
+from template_store import (
+    registry, TemplateError, TemplateNotFound, TemplateCatalog, TemplateManifest, content_hash, file_version,
+)
+from output import OutputSpool, SPOOL_DIR
+from assembler import assemble_bundle, template_range
+from layout import SectionSpec, Pairs, Labelled, Bullets, Fixed, measure, estimate_pages, paint
+from metrics import span
+from optimize import optimize_writer, size_report
+from logs import setup_logging
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FONT_FILES = {
+    "Montserrat-Regular": os.path.join(BASE_DIR, "fonts", "Montserrat-Regular.ttf"),
+    "Montserrat-Bold": os.path.join(BASE_DIR, "fonts", "Montserrat-Bold.ttf"),
+    "Montserrat-ExtraBold": os.path.join(BASE_DIR, "fonts", "Montserrat-ExtraBold.ttf"),
+}
+
+# Registra i font Montserrat (il parsing dei TTF è la parte più lenta dell'import)
+_fonts_start = time.perf_counter()
+for font_name, font_path in FONT_FILES.items():
+    pdfmetrics.registerFont(TTFont(font_name, font_path, subfontIndex=0))
+FONT_LOAD_SECONDS = time.perf_counter() - _fonts_start
+
+logger = logging.getLogger(__name__)
+
+# Versione della grafica dei report: va incrementata quando cambia il modo in
+# cui vengono disegnate le pagine, così le cache dei PDF si invalidano
+RENDER_VERSION = "4"
+
+# Cartella dei template (PDF + manifest <id>.json) e template predefinito
+TEMPLATE_DIR = os.environ.get("PDF_TEMPLATE_DIR") or os.path.join(BASE_DIR, "templates")
+DEFAULT_TEMPLATE_ID = os.environ.get("PDF_TEMPLATE_DEFAULT", "analisi")
+
+# Dimensioni della pagina 16:9 in punti (da 1440x810 px, a 96 DPI)
+PAGE_SIZE = (1440, 810)
+BOTTOM_MARGIN = 60
+
+# Colori gradiente
+TOP_COLOR = HexColor("#000000")      # nero
+MID_COLOR = HexColor("#001373")      # blu
+BOTTOM_COLOR = HexColor("#000000")   # nero
+WHITE = HexColor("#FFFFFF")
+
+# Nome del Form XObject con lo sfondo gradiente (uno per documento)
+BACKGROUND_FORM = "sfondo_gradiente"
+
+# Modello di memoria di un render nel worker: picco di RSS oltre al processo
+# già avviato, misurato su report da 450 a 1600 pagine custom (~22 KB a pagina)
+BASE_MEMORY_BYTES = 4 * 1024 * 1024
+PAGE_MEMORY_BYTES = 24 * 1024
+
+# Costo previsto di un report: pagine custom e memoria di picco in byte
+ReportCost = namedtuple("ReportCost", ["pagine", "byte"])
+
+
+# Payload di prova per il warm-up: tocca tutte le sezioni con testi brevi
+WARMUP_DATA = {
+    "sito_web": "www.esempio.it",
+    "benefici_prodotti": "Qualità|Assistenza",
+    "spiegazione_benefici_prodotti": "Materiali selezionati e lavorazione accurata.|Supporto rapido prima e dopo l'acquisto.",
+    "bisogni_robbins": "Certezza",
+    "spiegazione_bisogni_robbins": "Il cliente cerca garanzie chiare.",
+    "target_demografico": {"eta": "25-45 anni", "genere": "Misto", "professione": "Impiegati",
+                           "interessi": "Design, viaggi", "stile_vita": "Dinamico"},
+    "obiezioni": {"necessita": "Prezzo alto", "possibilita": "Alternative economiche", "tipo_soluzione": "Prodotto non visto",
+                  "risultati": "Durata incerta", "credibilita_azienda": "Marchio poco noto"},
+    "domande_tecniche": "Quali materiali utilizzate?|Offrite garanzia?",
+    "bisogni_derivati": "Status",
+    "spiegazione_bisogni_derivati": "Uno stile personale riconoscibile.",
+}
+
+
+# Coda verso il processo principale per l'avanzamento dei job (vedi init_worker)
+_progress_queue = None
+
+
+class ReportError(Exception):
+    """Errore nella generazione del report (es. template mancante o illeggibile)."""
+
+
+class UnknownTemplate(ReportError):
+    """Template richiesto non presente nel catalogo (errore del client)."""
+
+
+class InvalidSelection(ReportError):
+    """Pagine o sezioni richieste che il report non contiene (errore del client)."""
+
+
+def init_worker(progress_queue=None):
+    """
+    Inizializzatore dei processi worker: i font sono già registrati all'import
+    del modulo, qui precarichiamo il template così la prima richiesta non paga
+    il parsing. progress_queue (opzionale) riceve l'avanzamento dei job.
+    """
+    global _progress_queue
+    _progress_queue = progress_queue
+    setup_logging()
+    logger.info(f"Worker {os.getpid()}: font caricati in {FONT_LOAD_SECONDS * 1000:.1f} ms")
+    for template in TEMPLATES:
+        try:
+            load_template(template.id)
+        except ReportError as e:
+            # Il template verrà ricaricato alla prima richiesta
+            logger.warning(f"Worker {os.getpid()}: {str(e)}")
+
+
+def warm_up():
+    """
+    Render completo di prova, scartato, eseguito all'avvio: carica il
+    template, incorpora e sottoinsieme i font e percorre tutto il codice di
+    disegno e assemblaggio, così la prima richiesta reale non paga nulla di
+    tutto questo. Restituisce (pid, secondi).
+    """
+    t0 = time.perf_counter()
+    output = build_report(WARMUP_DATA)
+    output.cleanup()
+    return os.getpid(), time.perf_counter() - t0
+
+
+def report_progress(token, stage):
+    """Segnala al processo principale che la fase stage del job token è completata."""
+    if token is not None and _progress_queue is not None:
+        _progress_queue.put((token, stage))
+
+
+def get_template(template_id=None):
+    """Manifest del template con questo id (None = predefinito)."""
+    try:
+        return TEMPLATES.get(template_id)
+    except TemplateNotFound as e:
+        raise UnknownTemplate(str(e))
+
+
+def load_template(template_id=None):
+    """Restituisce il template già caricato dal registro del processo."""
+    try:
+        return registry.get(get_template(template_id).path)
+    except TemplateError as e:
+        raise ReportError(str(e))
+
+
+_fonts_version = None
+
+
+def template_diagnostics():
+    """
+    Stato di template e font per il log di avvio: contenuto della cartella e,
+    per ogni template del catalogo, percorso, esistenza, dimensione e
+    versione. "esiste" è vero se ci sono tutti. Eseguita una volta sola, mai
+    per richiesta.
+    """
+    info = {"cartella": TEMPLATE_DIR, "predefinito": TEMPLATES.default, "template": {}}
+    try:
+        info["file"] = sorted(os.listdir(TEMPLATE_DIR))
+    except OSError as e:
+        info["file"] = f"non leggibile: {str(e)}"
+    for template in TEMPLATES:
+        entry = {"file": template.path, "esiste": os.path.exists(template.path), "sezioni": template.sections}
+        if entry["esiste"]:
+            entry["byte"] = os.path.getsize(template.path)
+            entry["versione"] = file_version(template.path)
+        info["template"][template.id] = entry
+    info["esiste"] = all(entry["esiste"] for entry in info["template"].values())
+    info["font"] = {name: os.path.exists(path) for name, path in FONT_FILES.items()}
+    return info
+
+
+def fonts_version():
+    """Versione dei file dei font (calcolata una volta per processo)."""
+    global _fonts_version
+    if _fonts_version is None:
+        data = b""
+        for path in FONT_FILES.values():
+            with open(path, "rb") as f:
+                data += f.read()
+        _fonts_version = content_hash(data)
+    return _fonts_version
+
+
+def render_version(template_id=None):
+    """
+    Versione di tutto ciò che, oltre ai dati, determina il PDF prodotto:
+    codice di disegno, font, manifest e file del template. Entra nelle
+    chiavi di cache e negli ETag.
+    """
+    template = get_template(template_id)
+    try:
+        template_version = file_version(template.path)
+    except TemplateError as e:
+        raise ReportError(str(e))
+    return f"{RENDER_VERSION}-{fonts_version()}-{template.version}-{template_version}"
+
+
+def new_canvas(buffer):
+    """
+    Canvas per le pagine custom. In modalità invariante ReportLab non scrive
+    data di creazione né /ID casuale: gli stessi dati producono gli stessi
+    byte (anche per i PDF delle sezioni nella cache dei frammenti).
+    """
+    return canvas.Canvas(buffer, pagesize=PAGE_SIZE, invariant=1)
+
+
+def draw_page_header(c, title=None):
+    """Titolo principale e sottotitolo (opzionale), in un unico oggetto di testo."""
+    text = c.beginText(100, 675)
+    text.setFont("Montserrat-ExtraBold", 80)
+    text.textOut("ANALISI DI MERCATO")
+    if title:
+        text.moveCursor(0, 49)
+        text.setFont("Montserrat-Regular", 26)
+        text.textOut(title.upper())
+    c.drawText(text)
+
+def draw_vertical_gradient(c, width, height, top_color, mid_color, bottom_color, steps=200):
+    """
+    Disegna un gradiente verticale (90°) da top → mid → bottom.
+    """
+    for i in range(steps):
+        ratio = i / (steps - 1)
+        if ratio < 0.5:
+            local_ratio = ratio / 0.5
+            r = top_color.red + (mid_color.red - top_color.red) * local_ratio
+            g = top_color.green + (mid_color.green - top_color.green) * local_ratio
+            b = top_color.blue + (mid_color.blue - top_color.blue) * local_ratio
+        else:
+            local_ratio = (ratio - 0.5) / 0.5
+            r = mid_color.red + (bottom_color.red - mid_color.red) * local_ratio
+            g = mid_color.green + (bottom_color.green - mid_color.green) * local_ratio
+            b = mid_color.blue + (bottom_color.blue - mid_color.blue) * local_ratio
+
+        c.setFillColor(Color(r, g, b))
+        y = int(height * ratio)
+        c.rect(0, y, width, height / steps + 1, stroke=0, fill=1)
+
+
+def draw_background(c):
+    """
+    Disegna lo sfondo gradiente della pagina corrente.
+    Il gradiente viene definito una sola volta per documento come Form XObject
+    e ogni pagina lo richiama con doForm: costo e dimensione restano costanti
+    qualunque sia il numero di pagine.
+    """
+    if not c.hasForm(BACKGROUND_FORM):
+        c.beginForm(BACKGROUND_FORM)
+        draw_vertical_gradient(c, PAGE_SIZE[0], PAGE_SIZE[1], TOP_COLOR, MID_COLOR, BOTTOM_COLOR)
+        c.endForm()
+    c.doForm(BACKGROUND_FORM)
+
+
+def draw_page_chrome(c, title):
+    """Elementi fissi di ogni pagina custom: sfondo, intestazione e sottotitolo."""
+    draw_background(c)
+    c.setFillColor(WHITE)
+    draw_page_header(c, title)
+
+
+# Sezioni custom: ogni voce descrive dati letti, sottotitolo e impaginazione
+# (vedi layout.py); una nuova sezione non richiede codice di disegno
+SECTIONS = {
+    "benefici": SectionSpec(
+        "BENEFICI PER IL CLIENTE",
+        Pairs("benefici_prodotti", "spiegazione_benefici_prodotti"),
+        per_page=2,
+    ),
+    "bisogni": SectionSpec(
+        "BISOGNI PRIMARI (SECONDO LA TEORIA DI ROBBINS)",
+        Pairs("bisogni_robbins", "spiegazione_bisogni_robbins"),
+        per_page=2,
+    ),
+    "demografici": SectionSpec(
+        "DATI DEMOGRAFICI",
+        Labelled("target_demografico", [
+            ("eta", "Età"),
+            ("genere", "Genere"),
+            ("professione", "Professione"),
+            ("interessi", "Interessi"),
+            ("stile_vita", "Stile di vita"),
+        ]),
+        per_page=3,
+        item_gap=20,
+    ),
+    "obiezioni": SectionSpec(
+        "OBIEZIONI",
+        Labelled("obiezioni", [
+            ("necessita", "Necessità di risolvere il problema"),
+            ("possibilita", "Possibilità di trovare una soluzione"),
+            ("tipo_soluzione", "Tipo di soluzione proposta"),
+            ("risultati", "Possibilità di raggiungere i risultati"),
+            ("credibilita_azienda", "Credibilità azienda"),
+        ], split=True),
+        per_page=1,
+    ),
+    "domande": SectionSpec(
+        "DOMANDE TECNICHE",
+        Bullets("domande_tecniche"),
+        per_page=3,
+        body_indent=100,
+        item_gap=0,
+    ),
+    "competitor": SectionSpec(
+        "POSSIBILI DIFFICOLTÀ",
+        Fixed([
+            ("Competitor diretti:",
+             "Questi brand vendono articoli simili a quelli offerti da {sito_web} e operano nel nostro stesso mercato."),
+            ("Competitor indiretti:",
+             "Questi sono brand che soddisfano bisogni simili a quelli di {sito_web}, ma operano in mercati differenti."),
+        ], defaults={"sito_web": "il nostro Brand"}),
+        item_gap=60,
+    ),
+    "derivati": SectionSpec(
+        "BISOGNI DERIVATI",
+        Pairs("bisogni_derivati", "spiegazione_bisogni_derivati"),
+        per_page=2,
+    ),
+}
+
+
+def measure_section(name, data):
+    """Measure pass di una sezione: pagine e righe, senza disegnare."""
+    return measure(SECTIONS[name], data, PAGE_SIZE, bottom=BOTTOM_MARGIN)
+
+
+def estimate_cost(data, template_id=None, selection=None):
+    """
+    Costo previsto di un report, stimato dalla lunghezza dei testi (vedi
+    layout.estimate_pages) senza measure pass: serve al motore per decidere
+    se accettarlo, metterlo in attesa o scriverlo su disco (vedi
+    engine.RenderEngine). Con selection (vedi select_pages) contano solo le
+    sezioni da disegnare: quelle scelte e quelle in cui cadono le pagine
+    scelte, posizionate con le stesse stime.
+    """
+    manifest = get_template(template_id)
+    pages = {
+        name: estimate_pages(SECTIONS[name], data, PAGE_SIZE, bottom=BOTTOM_MARGIN) for name in manifest.sections
+    }
+    if selection:
+        names = set(selection.get("sezioni") or ())
+        numbers = selection.get("pagine") or ()
+        # Numero della prima pagina della voce corrente (None = oltre la fine nota del template)
+        position = 1
+        for entry in manifest.layout:
+            if entry[0] == "template":
+                _, start, end = entry
+                position = None if end is None or position is None else position + end - start
+            else:
+                name = entry[1]
+                if any(position is None or position <= number < position + pages[name] for number in numbers):
+                    names.add(name)
+                if position is not None:
+                    position += pages[name]
+        pages = {name: count for name, count in pages.items() if name in names}
+    total = sum(pages.values())
+    return ReportCost(total, BASE_MEMORY_BYTES + total * PAGE_MEMORY_BYTES)
+
+
+def section_data(name, data):
+    """Solo i campi di data letti dalla sezione (le chiavi assenti restano assenti)."""
+    return {field: data[field] for field in SECTIONS[name].fields if field in data}
+
+
+# Template predefinito: le sezioni custom vanno dopo le pagine 3, 4 e 59.
+# Altri template (varianti, lingue) si aggiungono con un manifest <id>.json
+# in TEMPLATE_DIR (vedi template_store.parse_manifest).
+ANALISI_TEMPLATE = TemplateManifest(
+    id="analisi",
+    path=os.path.join(TEMPLATE_DIR, "template_analisi.pdf"),
+    slots=(
+        (3, ("benefici", "bisogni", "demografici")),
+        (4, ("obiezioni", "domande", "competitor")),
+        (59, ("derivati",)),
+    ),
+    descrizione="Analisi di mercato",
+)
+
+TEMPLATES = TemplateCatalog(TEMPLATE_DIR, SECTIONS, builtin=[ANALISI_TEMPLATE], default=DEFAULT_TEMPLATE_ID)
+
+# Ordine del documento finale con il template "analisi"
+REPORT_LAYOUT = ANALISI_TEMPLATE.layout
+
+
+def draw_section(c, name, data):
+    """
+    Disegna una sezione sul canvas a partire dalla pagina corrente: prima
+    calcola l'impaginazione, poi la disegna chiudendo ogni pagina con showPage.
+    """
+    spec = SECTIONS[name]
+    paint(c, measure_section(name, data), lambda c: draw_page_chrome(c, spec.title), spec.line_height)
+
+
+def page_map(data, template_id=None):
+    """
+    Origine di ogni pagina del report completo, calcolata con il solo measure
+    pass (senza disegnare): ("template", indice nel template) oppure
+    ("sezione", nome, indice nella sezione).
+    """
+    manifest = get_template(template_id)
+    total = len(load_template(manifest.id))
+    pages = []
+    for entry in manifest.layout:
+        if entry[0] == "template":
+            _, start, end = entry
+            pages.extend(("template", i) for i in template_range(start, end, total))
+        else:
+            name = entry[1]
+            pages.extend(("sezione", name, i) for i in range(len(measure_section(name, data))))
+    return pages
+
+
+def select_pages(data, selection, template_id=None):
+    """
+    Pagine del report completo scelte da selection, un dict con "sezioni"
+    (nomi) e/o "pagine" (numeri da 1): l'unione delle due, in ordine.
+    Restituisce (page_map, numeri); solleva InvalidSelection per sezioni
+    che il template non contiene o pagine oltre la fine del report.
+    """
+    origins = page_map(data, template_id)
+    numbers = set(selection.get("pagine") or ())
+    out_of_range = sorted(number for number in numbers if not 1 <= number <= len(origins))
+    if out_of_range:
+        raise InvalidSelection(
+            f"Pagine inesistenti: {', '.join(map(str, out_of_range))} (il report ha {len(origins)} pagine)"
+        )
+
+    sections = get_template(template_id).sections
+    for name in selection.get("sezioni") or ():
+        if name not in sections:
+            raise InvalidSelection(f"Sezione sconosciuta: {name} (disponibili: {', '.join(sections)})")
+        numbers.update(number for number, origin in enumerate(origins, 1) if origin[0] == "sezione" and origin[1] == name)
+    return origins, sorted(numbers)
+
+
+def selection_layout(origins, numbers, section_pages):
+    """
+    Layout (vedi assembler.assemble) con le sole pagine numbers del report
+    completo, e le pagine custom corrispondenti: (layout, section_pages).
+    """
+    layout = []
+    selected = {}
+    for number in numbers:
+        origin = origins[number - 1]
+        if origin[0] == "template":
+            index = origin[1]
+            if layout and layout[-1][0] == "template" and layout[-1][2] == index:
+                layout[-1] = ("template", layout[-1][1], index + 1)
+            else:
+                layout.append(("template", index, index + 1))
+        else:
+            _, name, index = origin
+            if name not in selected:
+                selected[name] = []
+                layout.append(("sezione", name))
+            selected[name].append(section_pages[name][index])
+    return layout, selected
+
+
+def render_sections(data, names=None, progress=None, spool=False):
+    """
+    Disegna le sezioni richieste (tutte se names è None) su un unico canvas.
+    Restituisce il buffer PDF, l'intervallo [inizio, fine) delle pagine di
+    ogni sezione e i tempi di disegno: font e sfondo vengono così incorporati
+    una volta sola. progress è il token del job a cui segnalare ogni sezione
+    completata (vedi report_progress). Con spool il buffer è un file
+    temporaneo anonimo invece che in RAM (va chiuso dal chiamante).
+    """
+    buffer = tempfile.TemporaryFile(dir=SPOOL_DIR) if spool else io.BytesIO()
+    c = new_canvas(buffer)
+    ranges = {}
+    timings = {}
+
+    for name in SECTIONS if names is None else names:
+        start = c.getPageNumber() - 1
+        with span(timings, name):
+            draw_section(c, name, data)
+        ranges[name] = (start, c.getPageNumber() - 1)
+        report_progress(progress, name)
+
+    with span(timings, "serializzazione"):
+        c.save()
+    buffer.seek(0)
+    return buffer, ranges, timings
+
+
+def render_section(name, data):
+    """
+    Renderizza una sola sezione sul proprio canvas (modalità parallela).
+    Restituisce i byte del PDF della sezione e il tempo impiegato.
+    """
+    t0 = time.perf_counter()
+    section_buffer = io.BytesIO()
+    c = new_canvas(section_buffer)
+    draw_section(c, name, data)
+    c.save()
+    return section_buffer.getvalue(), time.perf_counter() - t0
+
+
+def render_fragments(sections, progress=None):
+    """
+    Renderizza più sezioni, ognuna sul proprio canvas, in un unico task.
+    sections è {nome: section_data}; restituisce {nome: (bytes, secondi)}.
+    I PDF delle singole sezioni possono così essere messi in cache.
+    """
+    fragments = {}
+    for name, data in sections.items():
+        fragments[name] = render_section(name, data)
+        report_progress(progress, name)
+    return fragments
+
+
+def write_report(section_pages, timings, optimize="fast", template_id=None, layout=None, labels=None, spool=False):
+    """
+    Unisce template e pagine custom e salva il risultato come PdfOutput.
+    Con optimize="size" ricomprime gli stream e fonde gli oggetti duplicati
+    prima della scrittura (vedi optimize.py): file più piccolo, render più lento.
+    layout sostituisce quello del template (es. per una selezione di pagine)
+    e labels sono i numeri da mostrare per ogni pagina (vedi assemble_bundle).
+    Con spool il PDF va direttamente su file temporaneo, qualunque sia la
+    dimensione.
+    """
+    # === Unisci il template con le pagine custom, negli slot del manifest ===
+    manifest = get_template(template_id)
+    with span(timings, "template"):
+        template = load_template(manifest.id)
+    logger.debug("Template %s ha %d pagine totali", manifest.id, len(template))
+
+    with span(timings, "assemblaggio"):
+        document = assemble_bundle(layout or manifest.layout, template.bundle, section_pages, labels)
+
+    # Il template compilato è già ricompresso: si ottimizzano le pagine custom
+    if optimize == "size":
+        with span(timings, "ottimizzazione"):
+            summary = optimize_writer(document.writer)
+        logger.debug("Ottimizzazione: %s", summary)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Composizione delle pagine custom: %s", size_report(document.writer))
+
+    # Salva il risultato: in memoria se piccolo, altrimenti su file temporaneo
+    with span(timings, "scrittura"):
+        output_spool = OutputSpool(threshold=0 if spool else None)
+        try:
+            document.write(output_spool)
+        except BaseException:
+            output_spool.discard()
+            raise
+
+    output = output_spool.finish()
+    output.timings = timings
+    output.pages = len(document.pages)
+    return output
+
+
+def assemble_fragments(fragments, timings=None, template_id=None):
+    """
+    Completa un report renderizzato in parallelo: fragments è {nome: bytes}
+    con il PDF di ogni sezione, uniti negli slot del template.
+    """
+    timings = dict(timings or {})
+    section_pages = {}
+    for name, pdf_bytes in fragments.items():
+        with span(timings, "lettura_pdf"):
+            section_reader = PdfReader(io.BytesIO(pdf_bytes))
+            section_pages[name] = list(section_reader.pages)
+        logger.debug("Sezione %s: %d pagine", name, len(section_pages[name]))
+
+    return write_report(section_pages, timings, template_id=template_id)
+
+
+def build_report(data, progress=None, optimize="fast", template_id=None, selection=None, spool=False):
+    """
+    Genera il PDF completo (template + sezioni custom) e lo restituisce come
+    PdfOutput (in memoria o su file temporaneo, vedi output.py).
+    optimize è la modalità di scrittura ("fast" o "size", vedi write_report),
+    template_id il template del catalogo (None = predefinito).
+    Con selection (vedi select_pages) il PDF contiene solo le pagine scelte e
+    vengono disegnate solo le sezioni che le contengono; le etichette delle
+    pagine restano quelle del report completo.
+    Con spool (report molto grandi, vedi engine.RenderEngine) le sezioni
+    disegnate e il PDF finale stanno su file temporanei invece che in RAM.
+    Gira nei processi worker del motore di rendering (vedi engine.py).
+    """
+    sections = get_template(template_id).sections
+    if selection:
+        origins, numbers = select_pages(data, selection, template_id)
+        chosen = {origins[number - 1][1] for number in numbers if origins[number - 1][0] == "sezione"}
+        sections = [name for name in sections if name in chosen]
+        if not sections:
+            # Solo pagine del template: nessuna sezione da disegnare
+            layout, _ = selection_layout(origins, numbers, {})
+            return write_report({}, {}, optimize, template_id, layout, numbers, spool)
+
+    # Le sezioni da disegnare, tutte in un solo passaggio: un solo PDF da rileggere
+    custom_buffer, ranges, timings = render_sections(data, sections, progress=progress, spool=spool)
+
+    # Il file delle sezioni viene letto a richiesta fino alla scrittura del PDF finale
+    with custom_buffer:
+        section_pages = {}
+        with span(timings, "lettura_pdf"):
+            custom_reader = PdfReader(custom_buffer)
+            for name, (start, end) in ranges.items():
+                section_pages[name] = [custom_reader.pages[i] for i in range(start, end)]
+        for name, (start, end) in ranges.items():
+            logger.debug("Sezione %s: %d pagine", name, end - start)
+
+        if selection:
+            layout, section_pages = selection_layout(origins, numbers, section_pages)
+            return write_report(section_pages, timings, optimize, template_id, layout, numbers, spool)
+        return write_report(section_pages, timings, optimize, template_id, spool=spool)
@@ -0,0 +1,90 @@
+"""
+Schema del payload dei report: validato e normalizzato una volta sola,
+all'arrivo della richiesta, prima di qualsiasi lavoro di rendering.
+
+- I campi a elenco accettano sia una stringa con voci separate da | (formato
+  storico) sia un array JSON, e diventano sempre liste di stringhe.
+- Numeri al posto delle stringhe vengono convertiti; null equivale a campo
+  assente; i campi non previsti vengono ignorati.
+- Limiti (variabili d'ambiente): voci per elenco e caratteri per valore.
+  Un payload oltre i limiti viene rifiutato con 422.
+"""
+import os
+from typing import Annotated, List, Optional
+
+from pydantic import AfterValidator, BaseModel, BeforeValidator, ConfigDict
+from pydantic_core import PydanticCustomError
+
+
+MAX_ITEMS = int(os.environ.get("PDF_PAYLOAD_MAX_ITEMS", 500))
+MAX_CHARS = int(os.environ.get("PDF_PAYLOAD_MAX_CHARS", 5000))
+
+# Tipo degli errori di validazione per valori oltre i limiti: il 422 non
+# ripete al client il valore rifiutato (vedi main.validation_error)
+TOO_LARGE = "troppo_grande"
+
+
+def _split(value):
+    if isinstance(value, str):
+        return value.split("|") if value else []
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return [str(value)]
+    return value
+
+
+def _check_items(items):
+    if len(items) > MAX_ITEMS:
+        raise PydanticCustomError(TOO_LARGE, "troppe voci: {voci} (max {max})", {"voci": len(items), "max": MAX_ITEMS})
+    return items
+
+
+def _check_chars(value):
+    if len(value) > MAX_CHARS:
+        raise PydanticCustomError(
+            TOO_LARGE, "testo troppo lungo: {caratteri} caratteri (max {max})", {"caratteri": len(value), "max": MAX_CHARS}
+        )
+    return value
+
+
+# Testo singolo e elenco di testi ("a|b" oppure ["a", "b"])
+Text = Annotated[str, AfterValidator(_check_chars)]
+TextList = Annotated[List[Text], BeforeValidator(_split), AfterValidator(_check_items)]
+
+
+class _Model(BaseModel):
+    model_config = ConfigDict(extra="ignore", coerce_numbers_to_str=True)
+
+
+class TargetDemografico(_Model):
+    eta: Optional[Text] = None
+    genere: Optional[Text] = None
+    professione: Optional[Text] = None
+    interessi: Optional[Text] = None
+    stile_vita: Optional[Text] = None
+
+
+class Obiezioni(_Model):
+    necessita: Optional[TextList] = None
+    possibilita: Optional[TextList] = None
+    tipo_soluzione: Optional[TextList] = None
+    risultati: Optional[TextList] = None
+    credibilita_azienda: Optional[TextList] = None
+
+
+class ReportData(_Model):
+    """Dati di un report (vedi le sezioni in report.SECTIONS)."""
+    sito_web: Optional[Text] = None
+    benefici_prodotti: Optional[TextList] = None
+    spiegazione_benefici_prodotti: Optional[TextList] = None
+    bisogni_robbins: Optional[TextList] = None
+    spiegazione_bisogni_robbins: Optional[TextList] = None
+    target_demografico: Optional[TargetDemografico] = None
+    obiezioni: Optional[Obiezioni] = None
+    domande_tecniche: Optional[TextList] = None
+    bisogni_derivati: Optional[TextList] = None
+    spiegazione_bisogni_derivati: Optional[TextList] = None
+
+    def as_dict(self):
+        """Payload normalizzato per il rendering: solo i campi presenti, elenchi come liste."""
+        return self.model_dump(exclude_none=True)
+
@@ -0,0 +1,241 @@
+"""
+Template "compilato": gli oggetti PDF raggiungibili dalle pagine del template
+già serializzati, con numerazione e offset fissi.
+
+Nel documento finale gli oggetti del template occupano sempre i numeri
+1..N e l'albero delle pagine il numero N+1 (a cui puntano i /Parent delle
+pagine del template): il blocco di byte viene copiato così com'è, senza
+passare dal modello a oggetti di PyPDF2. Solo gli oggetti delle pagine
+custom vengono serializzati a ogni richiesta, spostati di N.
+
+Compilazione offline (ogni file .bundle va accanto al suo PDF):
+
+    python -m template_bundle templates/*.pdf
+
+Se il file manca o non corrisponde al PDF, il registro dei template lo
+compila al caricamento e prova a salvarlo (vedi template_store.py).
+"""
+import io
+import sys
+import json
+import time
+from dataclasses import dataclass, field
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject
+
+from optimize import compress_stream
+
+
+MAGIC = b"PDFBUNDLE 2\n"
+
+
+class BundleError(Exception):
+    """File .bundle non valido."""
+
+
+@dataclass
+class TemplateBundle:
+    """
+    Oggetti del template serializzati ("n 0 obj ... endobj") in blob, con
+    offset relativi all'inizio del blob. pages sono i numeri degli oggetti
+    pagina, nell'ordine del template; page_objects, per ogni pagina, i
+    numeri degli oggetti che le servono (lei compresa).
+    """
+    version: str
+    header: bytes
+    offsets: list
+    pages: list
+    page_objects: list = field(repr=False)
+    blob: bytes = field(repr=False)
+
+    @property
+    def count(self):
+        return len(self.offsets)
+
+    @property
+    def pages_number(self):
+        """Numero riservato all'albero delle pagine del documento finale."""
+        return self.count + 1
+
+    def __len__(self):
+        return len(self.pages)
+
+    def objects_for(self, page_numbers):
+        """Numeri (ordinati) degli oggetti che servono alle pagine indicate (numeri di oggetto)."""
+        needed = set()
+        for index, number in enumerate(self.pages):
+            if number in page_numbers:
+                needed.update(self.page_objects[index])
+        return sorted(needed)
+
+    def object_bytes(self, number):
+        """L'oggetto number serializzato, come vista sul blob."""
+        start = self.offsets[number - 1]
+        end = self.offsets[number] if number < self.count else len(self.blob)
+        return self.blob[start:end]
+
+
+def renumbered(obj, number):
+    """
+    Copia superficiale di obj con i riferimenti indiretti rinumerati da
+    number(idnum). Gli stream mantengono i dati già codificati.
+    """
+    if isinstance(obj, IndirectObject):
+        return IndirectObject(number(obj.idnum), 0, None)
+    if isinstance(obj, StreamObject):
+        copy = obj.__class__()
+        copy._data = obj._data
+        for key, value in obj.items():
+            copy[key] = renumbered(value, number)
+        return copy
+    if isinstance(obj, DictionaryObject):
+        copy = DictionaryObject()
+        for key, value in obj.items():
+            copy[key] = renumbered(value, number)
+        return copy
+    if isinstance(obj, ArrayObject):
+        return ArrayObject(renumbered(value, number) for value in obj)
+    return obj
+
+
+def serialize(number, obj):
+    """Oggetto indiretto completo, pronto da scrivere nel file."""
+    buffer = io.BytesIO()
+    buffer.write(b"%d 0 obj\n" % number)
+    obj.write_to_stream(buffer, None)
+    buffer.write(b"\nendobj\n")
+    return buffer.getvalue()
+
+
+def compile_template(data, version):
+    """Compila il PDF del template (bytes) in un TemplateBundle."""
+    reader = PdfReader(io.BytesIO(data))
+    numbers = {}
+    order = []
+
+    def visit(obj, reached):
+        if isinstance(obj, IndirectObject):
+            if obj.idnum in reached:
+                return
+            reached.add(obj.idnum)
+            if obj.idnum not in numbers:
+                numbers[obj.idnum] = len(order) + 1
+                order.append(obj.idnum)
+            obj = obj.get_object()
+        if isinstance(obj, DictionaryObject):
+            for key, value in obj.items():
+                # /Parent delle pagine: diventa l'albero delle pagine del documento finale
+                if key != "/Parent" or obj.get("/Type") != "/Page":
+                    visit(value, reached)
+        elif isinstance(obj, ArrayObject):
+            for value in obj:
+                visit(value, reached)
+
+    # reader.pages ha già copiato nelle pagine gli attributi ereditati (/Resources, /MediaBox, ...)
+    page_objects = []
+    for page in reader.pages:
+        reached = set()
+        visit(page.indirect_reference, reached)
+        page_objects.append(sorted(numbers[idnum] for idnum in reached))
+    pages_number = len(order) + 1
+
+    blob = io.BytesIO()
+    offsets = []
+    for idnum in order:
+        obj = reader.get_object(idnum)
+        if isinstance(obj, DictionaryObject) and obj.get("/Type") == "/Page":
+            page = DictionaryObject(obj)
+            del page["/Parent"]
+            copy = renumbered(page, numbers.__getitem__)
+            copy[NameObject("/Parent")] = IndirectObject(pages_number, 0, None)
+        else:
+            copy = renumbered(obj, numbers.__getitem__)
+        if isinstance(copy, StreamObject):
+            compress_stream(copy)
+        offsets.append(blob.tell())
+        blob.write(serialize(numbers[idnum], copy))
+
+    header = reader.pdf_header
+    if isinstance(header, str):
+        header = header.encode()
+    return TemplateBundle(
+        version=version,
+        header=header,
+        offsets=offsets,
+        pages=[numbers[page.indirect_reference.idnum] for page in reader.pages],
+        page_objects=page_objects,
+        blob=blob.getvalue(),
+    )
+
+
+def dump(bundle, stream):
+    meta = {
+        "version": bundle.version,
+        "header": bundle.header.decode("latin-1"),
+        "offsets": bundle.offsets,
+        "pages": bundle.pages,
+        "page_objects": bundle.page_objects,
+        "blob": len(bundle.blob),
+    }
+    stream.write(MAGIC)
+    stream.write(json.dumps(meta).encode() + b"\n")
+    stream.write(bundle.blob)
+
+
+def load(data):
+    """
+    TemplateBundle da un file .bundle già letto (bytes) o mappato in memoria
+    (mmap): il blob è una vista sui dati, senza copia.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise BundleError("Formato del bundle non riconosciuto")
+    end = data.find(b"\n", len(MAGIC))
+    try:
+        meta = json.loads(data[len(MAGIC):end])
+    except ValueError as e:
+        raise BundleError(f"Intestazione del bundle non valida: {str(e)}")
+    blob = memoryview(data)[end + 1:]
+    try:
+        if len(blob) != meta["blob"]:
+            raise BundleError(f"Bundle troncato: {len(blob)} byte su {meta['blob']}")
+        return TemplateBundle(
+            version=meta["version"],
+            header=meta["header"].encode("latin-1"),
+            offsets=meta["offsets"],
+            pages=meta["pages"],
+            page_objects=meta["page_objects"],
+            blob=blob,
+        )
+    except (KeyError, TypeError, AttributeError) as e:
+        raise BundleError(f"Intestazione del bundle incompleta: {e!r}")
+
+
+def bundle_path(template_path):
+    return template_path + ".bundle"
+
+
+def main(argv):
+    from template_store import content_hash
+
+    if not argv:
+        print(__doc__)
+        return 1
+
+    for path in argv:
+        output = bundle_path(path)
+        t0 = time.perf_counter()
+        with open(path, "rb") as f:
+            data = f.read()
+        bundle = compile_template(data, content_hash(data))
+        with open(output, "wb") as f:
+            dump(bundle, f)
+        print(
+            f"{output}: {len(bundle)} pagine, {bundle.count} oggetti, {len(bundle.blob) / 1024:.1f} KB "
+            f"(versione {bundle.version}, {(time.perf_counter() - t0) * 1000:.0f} ms)"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,348 @@
+import os
+import json
+import mmap
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from dataclasses import dataclass, field
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject
+
+import template_bundle
+
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateError(Exception):
+    """Template mancante o non leggibile."""
+
+
+class TemplateNotFound(TemplateError):
+    """Id di template non presente nel catalogo."""
+
+
+def content_hash(data):
+    """Versione di un file: prefisso dello sha256 del contenuto."""
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+_file_versions = {}
+
+
+def file_version(path):
+    """
+    Versione del file senza parsarlo (es. nel processo principale, per le
+    chiavi di cache). Il contenuto viene riletto solo se cambiano mtime o
+    dimensione.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise TemplateError(f"Template PDF non trovato: {path}")
+
+    cached = _file_versions.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    with open(path, "rb") as f:
+        version = content_hash(f.read())
+    _file_versions[path] = (stat.st_mtime_ns, stat.st_size, version)
+    return version
+
+
+def map_file(path):
+    """
+    File mappato in memoria in sola lettura: i processi che mappano lo stesso
+    file condividono le pagine nella page cache del sistema operativo.
+    I file mappati vanno sostituiti (nuovo file + rename), mai riscritti sul
+    posto: chi li sta leggendo vedrebbe il contenuto cambiare o troncarsi.
+    """
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _resolve_all(obj, seen):
+    """Risolve in anticipo tutti gli oggetti indiretti raggiungibili da obj."""
+    if isinstance(obj, IndirectObject):
+        if obj.idnum in seen:
+            return
+        seen.add(obj.idnum)
+        obj = obj.get_object()
+    if isinstance(obj, DictionaryObject):
+        for key, value in obj.items():
+            if key != "/Parent":
+                _resolve_all(value, seen)
+    elif isinstance(obj, ArrayObject):
+        for value in obj:
+            _resolve_all(value, seen)
+
+
+# === Catalogo dei template ===
+
+def layout_from_slots(slots):
+    """
+    Layout del documento (vedi assembler.assemble) dagli slot di un manifest:
+    slots è [(dopo_pagina, [sezioni...]), ...] ordinato per pagina.
+    """
+    layout = []
+    previous = 0
+    for after_page, sections in slots:
+        layout.append(("template", previous, after_page))
+        layout.extend(("sezione", name) for name in sections)
+        previous = after_page
+    layout.append(("template", previous, None))
+    return layout
+
+
+@dataclass(frozen=True)
+class TemplateManifest:
+    """
+    Un template del catalogo: PDF e slot di inserimento delle sezioni custom
+    (dopo quale pagina del template va ogni gruppo di sezioni).
+    """
+    id: str
+    path: str
+    slots: tuple
+    descrizione: str = ""
+
+    @property
+    def layout(self):
+        return layout_from_slots(self.slots)
+
+    @property
+    def sections(self):
+        return [name for _, names in self.slots for name in names]
+
+    @property
+    def version(self):
+        """Versione del manifest (file e slot): entra nelle chiavi di cache."""
+        return content_hash(json.dumps([os.path.basename(self.path), self.slots]).encode())
+
+
+def parse_manifest(template_id, manifest, directory, sections):
+    """
+    TemplateManifest da un manifest JSON già letto:
+
+        {"file": "template_analisi_en.pdf", "descrizione": "...",
+         "slot": {"3": ["benefici", "bisogni"], "59": ["derivati"]}}
+
+    Le chiavi di "slot" sono il numero di pagine del template che precedono
+    le sezioni; sections sono i nomi di sezione validi.
+    """
+    if not isinstance(manifest.get("file"), str) or not isinstance(manifest.get("slot"), dict):
+        raise TemplateError("il manifest deve avere 'file' (stringa) e 'slot' (oggetto)")
+
+    slots = []
+    for after_page, names in manifest["slot"].items():
+        try:
+            after_page = int(after_page)
+        except ValueError:
+            raise TemplateError(f"slot '{after_page}' non è un numero di pagina")
+        if after_page < 0 or not isinstance(names, list) or not names:
+            raise TemplateError(f"slot {after_page}: attesa una lista non vuota di sezioni")
+        unknown = [name for name in names if name not in sections]
+        if unknown:
+            raise TemplateError(f"slot {after_page}: sezioni sconosciute {', '.join(map(str, unknown))}")
+        slots.append((after_page, tuple(names)))
+
+    return TemplateManifest(
+        id=template_id,
+        path=os.path.join(directory, manifest["file"]),
+        slots=tuple(sorted(slots)),
+        descrizione=str(manifest.get("descrizione", "")),
+    )
+
+
+class TemplateCatalog:
+    """
+    Template disponibili, per id: quelli predefiniti (builtin) più un
+    manifest <id>.json per ogni template nella cartella dei template.
+    Un manifest con lo stesso id di un template predefinito lo sostituisce;
+    i manifest non validi vengono ignorati (con un errore nel log).
+    """
+
+    def __init__(self, directory, sections, builtin=(), default=None):
+        self.directory = directory
+        self.sections = sections
+        self.default = default
+        self._templates = {manifest.id: manifest for manifest in builtin}
+        self._load_manifests()
+
+    def _load_manifests(self):
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError:
+            return
+
+        for name in names:
+            template_id, ext = os.path.splitext(name)
+            if ext != ".json":
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    manifest = json.load(f)
+                self._templates[template_id] = parse_manifest(template_id, manifest, self.directory, self.sections)
+            except (OSError, ValueError, TemplateError) as e:
+                logger.error(f"Manifest del template {name} ignorato: {str(e)}")
+
+    def get(self, template_id=None):
+        template_id = template_id or self.default
+        try:
+            return self._templates[template_id]
+        except KeyError:
+            raise TemplateNotFound(f"Template sconosciuto: {template_id} (disponibili: {', '.join(self.ids())})")
+
+    def ids(self):
+        return sorted(self._templates)
+
+    def __iter__(self):
+        return iter(self._templates.values())
+
+
+# === Registro dei template caricati ===
+
+@dataclass
+class LoadedTemplate:
+    """
+    Template caricato: PDF e template compilato (bundle, copiato come byte
+    nel documento finale) mappati in memoria, versione del file. Il PDF
+    viene parsato solo se serve (reader/pages), non per comporre i report.
+    """
+    path: str
+    mtime_ns: int
+    size: int
+    version: str
+    data: mmap.mmap = field(repr=False)
+    bundle: template_bundle.TemplateBundle = field(repr=False)
+    checked_at: float = 0.0
+    _reader: PdfReader = field(default=None, repr=False)
+
+    @property
+    def reader(self):
+        if self._reader is None:
+            reader = PdfReader(self.data)
+            seen = set()
+            for page in reader.pages:
+                _resolve_all(page, seen)
+            self._reader = reader
+        return self._reader
+
+    @property
+    def pages(self):
+        return self.reader.pages
+
+    def __len__(self):
+        return len(self.bundle)
+
+
+class TemplateRegistry:
+    """
+    Cache per processo dei template PDF.
+    Ogni file viene mappato e indicizzato una sola volta; le richieste
+    successive riusano lo stesso bundle. Le modifiche al file vengono
+    rilevate tramite mtime/dimensione (al massimo ogni check_interval secondi)
+    e il template viene ricaricato in modo atomico: chi sta usando la versione
+    precedente continua a usarla fino alla fine della richiesta.
+    """
+
+    def __init__(self, check_interval=None):
+        if check_interval is None:
+            check_interval = float(os.environ.get("PDF_TEMPLATE_CHECK_INTERVAL", 2))
+        self.check_interval = check_interval
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        current = self._templates.get(path)
+        now = time.monotonic()
+        if current is not None and now - current.checked_at < self.check_interval:
+            return current
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise TemplateError(f"Template PDF non trovato: {path}")
+
+        if current is not None and (stat.st_mtime_ns, stat.st_size) == (current.mtime_ns, current.size):
+            current.checked_at = now
+            return current
+
+        with self._lock:
+            # Un altro thread potrebbe averlo già ricaricato
+            current = self._templates.get(path)
+            if current is not None and (stat.st_mtime_ns, stat.st_size) == (current.mtime_ns, current.size):
+                current.checked_at = now
+                return current
+
+            loaded = self._load(path, stat)
+            self._templates[path] = loaded
+            return loaded
+
+    def _load(self, path, stat):
+        start = time.perf_counter()
+        try:
+            data = map_file(path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Errore durante l'apertura del template: {str(e)}", exc_info=True)
+            raise TemplateError(f"Errore lettura template: {str(e)}")
+
+        version = content_hash(data)
+        loaded = LoadedTemplate(
+            path=path,
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+            version=version,
+            data=data,
+            bundle=self._load_bundle(path, data, version),
+            checked_at=time.monotonic(),
+        )
+        logger.info(
+            f"Template caricato: {path} ({len(loaded)} pagine, versione {loaded.version}, "
+            f"{(time.perf_counter() - start) * 1000:.1f} ms)"
+        )
+        return loaded
+
+    def _load_bundle(self, path, data, version):
+        """
+        Template compilato, mappato dal file .bundle se corrisponde a questa
+        versione del PDF. Altrimenti viene compilato qui e salvato accanto al
+        PDF (così gli altri worker lo mappano invece di ricompilarlo); se la
+        cartella non è scrivibile resta in memoria, privato del processo.
+        """
+        bundle_path = template_bundle.bundle_path(path)
+        try:
+            bundle = template_bundle.load(map_file(bundle_path))
+            if bundle.version == version:
+                return bundle
+            logger.warning(f"Bundle {bundle_path} obsoleto (versione {bundle.version}, template {version}): lo ricompilo")
+        except FileNotFoundError:
+            logger.info(f"Bundle {bundle_path} non trovato: compilo il template")
+        except (OSError, ValueError, template_bundle.BundleError) as e:
+            logger.warning(f"Bundle {bundle_path} non valido ({str(e)}): lo ricompilo")
+
+        try:
+            bundle = template_bundle.compile_template(data, version)
+        except Exception as e:
+            logger.error(f"Errore durante la compilazione del template: {str(e)}", exc_info=True)
+            raise TemplateError(f"Errore compilazione template: {str(e)}")
+
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(bundle_path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                template_bundle.dump(bundle, f)
+            os.replace(tmp_path, bundle_path)
+            return template_bundle.load(map_file(bundle_path))
+        except OSError as e:
+            logger.warning(f"Bundle {bundle_path} non salvato ({str(e)}): resta in memoria")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return bundle
+
+
+# Registro condiviso dal processo
+registry = TemplateRegistry()
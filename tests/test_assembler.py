@@ -0,0 +1,44 @@
+import io
+
+import pytest
+from PyPDF2 import PdfReader
+from reportlab.pdfgen import canvas
+
+import template_bundle
+from assembler import assemble_bundle
+from optimize import optimize_writer
+
+
+def make_pdf(texts):
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=(400, 300), invariant=1)
+    for text in texts:
+        c.setFont("Helvetica", 20)
+        c.drawString(50, 150, text)
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def test_size_mode_with_duplicate_pages_keeps_page_tree():
+    template = make_pdf(["Template 1", "Template 2"])
+    bundle = template_bundle.compile_template(template, "test")
+    # Pagine custom identiche: la deduplicazione fonde i loro stream e rinumera il writer
+    section = PdfReader(io.BytesIO(make_pdf(["Qualità"] * 4)))
+    layout = [("template", 0, 1), ("sezione", "benefici"), ("template", 1, None)]
+
+    document = assemble_bundle(layout, bundle, {"benefici": list(section.pages)})
+    assert optimize_writer(document.writer)["oggetti_fusi"] > 0
+    output = io.BytesIO()
+    document.write(output)
+
+    reader = PdfReader(io.BytesIO(output.getvalue()))
+    assert [page.get("/Type") for page in reader.pages] == ["/Page"] * 6
+    texts = [page.extract_text().strip() for page in reader.pages]
+    assert texts == ["Template 1"] + ["Qualità"] * 4 + ["Template 2"]
+
+
+def test_load_rejects_bundle_with_incomplete_header():
+    data = template_bundle.MAGIC + b'{"version": "x"}\n'
+    with pytest.raises(template_bundle.BundleError):
+        template_bundle.load(data)
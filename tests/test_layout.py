@@ -0,0 +1,23 @@
+import random
+
+import report
+from layout import estimate_pages
+
+
+def wide_text(rng, words):
+    """Parole in maiuscolo fatte solo di lettere larghe."""
+    return " ".join("".join(rng.choice("MWQOGD") for _ in range(rng.randint(3, 9))) for _ in range(words))
+
+
+def test_estimate_pages_is_not_below_measure_with_wide_glyphs():
+    rng = random.Random(0)
+    data = {
+        "benefici_prodotti": "|".join(wide_text(rng, 3) for _ in range(100)),
+        "spiegazione_benefici_prodotti": "|".join(wide_text(rng, 80) for _ in range(100)),
+        "obiezioni": {field: "|".join(wide_text(rng, 120) for _ in range(5)) for field in (
+            "necessita", "possibilita", "tipo_soluzione", "risultati", "credibilita_azienda")},
+    }
+    for name in ("benefici", "obiezioni"):
+        pages = len(report.measure_section(name, data))
+        assert pages > 10
+        assert estimate_pages(report.SECTIONS[name], data, report.PAGE_SIZE, bottom=report.BOTTOM_MARGIN) >= pages
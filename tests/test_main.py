@@ -0,0 +1,38 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+import preview
+import schema
+
+
+def test_parse_pages_merges_ranges():
+    assert main.parse_pages("3-5,1,4", 10) == [1, 3, 4, 5]
+
+
+def test_parse_pages_rejects_huge_range_without_expanding_it():
+    start = time.perf_counter()
+    with pytest.raises(HTTPException) as error:
+        main.parse_pages("1-2000000000", preview.MAX_PAGES, "Troppe pagine per l'anteprima")
+    assert time.perf_counter() - start < 0.1
+    assert error.value.status_code == 422
+    assert f"max {preview.MAX_PAGES}" in error.value.detail
+
+
+def test_parse_selection_caps_page_ranges():
+    with pytest.raises(HTTPException) as error:
+        main.parse_selection(None, f"1-{main.MAX_SELECTED_PAGES},{main.MAX_SELECTED_PAGES + 1}-2000000000")
+    assert error.value.status_code == 422
+    assert main.parse_selection(None, "1-3,60") == {"pagine": [1, 2, 3, 60]}
+
+
+def test_oversized_payload_is_not_echoed_back():
+    client = TestClient(main.app)
+    response = client.post("/generate-pdf", json={"data": {"sito_web": "x" * (schema.MAX_CHARS + 1)}})
+    assert response.status_code == 422
+    error = response.json()["detail"][0]
+    assert error["type"] == schema.TOO_LARGE
+    assert "input" not in error
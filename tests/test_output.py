@@ -0,0 +1,11 @@
+import os
+
+from output import OutputSpool
+
+
+def test_discard_removes_spilled_file(tmp_path):
+    spool = OutputSpool(threshold=4, directory=str(tmp_path))
+    spool.write(b"%PDF-1.4\n")
+    assert os.listdir(tmp_path)
+    spool.discard()
+    assert not os.listdir(tmp_path)